@@ -0,0 +1,258 @@
+"""Cold archive for old channel history.
+
+The retention job moves messages older than QUICKLINK_ARCHIVE_AFTER_DAYS out of
+`messages` into append-only segments in a separate SQLite file
+(database.ARCHIVE_PATH). A segment is one compressed block of consecutive
+messages of one channel; its row in `archive_segments` (channel, id range,
+time range) is the small index used to find it again. Segments are never
+modified, only appended or dropped with their channel.
+
+crud.get_channel_messages falls through to the archive when a page runs past
+the oldest hot message, so cursor paging reaches archived history
+transparently. Archived messages leave the full-text search index.
+
+Run periodically (e.g. a daily cron / systemd timer):
+
+    python archive.py run [--older-than-days N]
+"""
+import argparse
+import os
+import threading
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+import orjson
+from sqlalchemy import (
+    Column, Index, Integer, LargeBinary, MetaData, String, Table, and_, bindparam, delete, insert, or_, select, text,
+)
+
+import database
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("QUICKLINK_ARCHIVE_AFTER_DAYS", "180"))
+# Messages per segment; bigger segments compress better but cost more to decode per page
+SEGMENT_SIZE = int(os.environ.get("QUICKLINK_ARCHIVE_SEGMENT_SIZE", "1000"))
+# Channels with fewer old messages than this wait for the next run instead of writing tiny segments
+MIN_SEGMENT_SIZE = int(os.environ.get("QUICKLINK_ARCHIVE_MIN_SEGMENT_SIZE", "100"))
+# Decoded segments kept in memory per worker (segments are immutable, so never stale)
+SEGMENT_CACHE_SIZE = int(os.environ.get("QUICKLINK_ARCHIVE_SEGMENT_CACHE", "64"))
+ZLIB_LEVEL = 6
+
+metadata = MetaData()
+
+segments = Table(
+    "archive_segments", metadata,
+    # AUTOINCREMENT: ids are never reused, so cached segments stay valid after drops
+    Column("id", Integer, primary_key=True),
+    Column("channel_id", Integer, nullable=False),
+    Column("min_message_id", Integer, nullable=False),
+    Column("max_message_id", Integer, nullable=False),
+    Column("first_timestamp", String, nullable=False),
+    Column("last_timestamp", String, nullable=False),
+    Column("message_count", Integer, nullable=False),
+    Column("codec", String, nullable=False),
+    # orjson list of [id, timestamp, user_id, content], oldest first
+    Column("data", LargeBinary, nullable=False),
+    Index("ix_archive_segments_channel_max_id", "channel_id", "max_message_id"),
+    sqlite_autoincrement=True,
+)
+
+# One archived message: (id, raw timestamp, user_id, content)
+Row = Tuple[int, str, int, str]
+
+_ready = False
+_ready_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    """True once the archive file holds the segments table (checked without creating the file)."""
+    global _ready
+    if _ready:
+        return True
+    if not os.path.exists(database.ARCHIVE_PATH):
+        return False
+    with _ready_lock:
+        with database.archive_engine.connect() as conn:
+            _ready = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'archive_segments'"
+            )).first() is not None
+    return _ready
+
+
+def ensure_schema():
+    metadata.create_all(database.archive_engine)
+
+
+def _encode(rows: List[Row]) -> bytes:
+    return zlib.compress(orjson.dumps(rows), ZLIB_LEVEL)
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _segment(segment_id: int) -> List[Row]:
+    with database.archive_engine.connect() as conn:
+        data = conn.execute(select(segments.c.data).where(segments.c.id == segment_id)).scalar_one()
+    return [tuple(row) for row in orjson.loads(zlib.decompress(data))]
+
+
+def _locate(conn, channel_id: int, message_id: int) -> Optional[Tuple[int, int]]:
+    """(segment id, position in segment) of an archived message."""
+    candidates = conn.execute(
+        select(segments.c.id).where(
+            segments.c.channel_id == channel_id,
+            segments.c.max_message_id >= message_id,
+            segments.c.min_message_id <= message_id,
+        ).order_by(segments.c.id)
+    ).scalars().all()
+    for segment_id in candidates:
+        for pos, row in enumerate(_segment(segment_id)):
+            if row[0] == message_id:
+                return segment_id, pos
+    return None
+
+
+def contains(channel_id: int, message_id: int) -> bool:
+    with database.archive_engine.connect() as conn:
+        return _locate(conn, channel_id, message_id) is not None
+
+
+def read_before(channel_id: int, message_id: Optional[int], limit: int) -> List[Row]:
+    """Up to `limit` archived messages older than `message_id` (None: the newest ones), newest first."""
+    with database.archive_engine.connect() as conn:
+        stmt = select(segments.c.id).where(segments.c.channel_id == channel_id)
+        start = None
+        if message_id is not None:
+            start = _locate(conn, channel_id, message_id)
+            if start is None:
+                return []
+            stmt = stmt.where(segments.c.id <= start[0])
+        # Every segment holds at least one message, so `limit` segments always suffice
+        segment_ids = conn.execute(stmt.order_by(segments.c.id.desc()).limit(limit)).scalars().all()
+    result: List[Row] = []
+    for segment_id in segment_ids:
+        rows = _segment(segment_id)
+        if start is not None and segment_id == start[0]:
+            rows = rows[:start[1]]
+        result.extend(reversed(rows))
+        if len(result) >= limit:
+            break
+    return result[:limit]
+
+
+def read_after(channel_id: int, message_id: int, limit: int) -> List[Row]:
+    """Up to `limit` archived messages newer than `message_id`, oldest first."""
+    with database.archive_engine.connect() as conn:
+        start = _locate(conn, channel_id, message_id)
+        if start is None:
+            return []
+        segment_ids = conn.execute(
+            select(segments.c.id).where(segments.c.channel_id == channel_id, segments.c.id >= start[0])
+            .order_by(segments.c.id).limit(limit + 1)
+        ).scalars().all()
+    result: List[Row] = []
+    for segment_id in segment_ids:
+        rows = _segment(segment_id)
+        if segment_id == start[0]:
+            rows = rows[start[1] + 1:]
+        result.extend(rows)
+        if len(result) >= limit:
+            break
+    return result[:limit]
+
+
+def archived_cursors(cursors: Dict[int, int]) -> Set[int]:
+    """Channels whose cursor message id falls in an archived segment (index only, no decoding)."""
+    conditions = [
+        and_(segments.c.channel_id == channel_id,
+             segments.c.min_message_id <= message_id, segments.c.max_message_id >= message_id)
+        for channel_id, message_id in cursors.items()
+    ]
+    if not conditions:
+        return set()
+    with database.archive_engine.connect() as conn:
+        return set(conn.execute(select(segments.c.channel_id).where(or_(*conditions)).distinct()).scalars())
+
+
+def drop_channels(channel_ids: List[int]):
+    """Forget the archived history of deleted channels."""
+    if channel_ids and enabled():
+        with database.archive_engine.begin() as conn:
+            conn.execute(delete(segments).where(segments.c.channel_id.in_(channel_ids)))
+
+
+# --- Retention job ---
+
+def _finish_interrupted(hot, channel_id: int):
+    """Remove hot copies of the newest segment, in case the last run stopped between its two commits."""
+    with database.archive_engine.connect() as conn:
+        last = conn.execute(
+            select(segments.c.id).where(segments.c.channel_id == channel_id).order_by(segments.c.id.desc()).limit(1)
+        ).scalar()
+    if last is None:
+        return
+    ids = [row[0] for row in _segment(last)]
+    hot.execute(
+        text("DELETE FROM messages WHERE channel_id = :channel_id AND id IN :ids").bindparams(
+            bindparam("ids", expanding=True)
+        ),
+        {"channel_id": channel_id, "ids": ids},
+    )
+    hot.commit()
+
+
+def archive_channel(hot, channel_id: int, cutoff: str) -> int:
+    """Move one channel's messages older than `cutoff` into segments; returns the count moved."""
+    _finish_interrupted(hot, channel_id)
+    moved = 0
+    while True:
+        rows = hot.execute(text(
+            "SELECT id, timestamp, user_id, content FROM messages "
+            "WHERE channel_id = :channel_id AND timestamp < :cutoff ORDER BY timestamp, id LIMIT :n"
+        ), {"channel_id": channel_id, "cutoff": cutoff, "n": SEGMENT_SIZE}).all()
+        if not rows or len(rows) < min(MIN_SEGMENT_SIZE, SEGMENT_SIZE):
+            return moved
+        rows = [tuple(row) for row in rows]
+        ids = [row[0] for row in rows]
+        # Archive first, then delete: a crash in between leaves duplicates that the next run removes
+        with database.archive_engine.begin() as conn:
+            conn.execute(insert(segments).values(
+                channel_id=channel_id,
+                min_message_id=min(ids),
+                max_message_id=max(ids),
+                first_timestamp=rows[0][1],
+                last_timestamp=rows[-1][1],
+                message_count=len(rows),
+                codec="zlib",
+                data=_encode(rows),
+            ))
+        hot.execute(
+            text("DELETE FROM messages WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids},
+        )
+        hot.commit()
+        moved += len(rows)
+        if len(rows) < SEGMENT_SIZE:
+            return moved
+
+
+def run(older_than_days: int = ARCHIVE_AFTER_DAYS) -> int:
+    ensure_schema()
+    moved = 0
+    with database.engine.connect() as hot:
+        # Same clock and format as the messages.timestamp server default
+        cutoff = hot.execute(text("SELECT datetime('now', :age)"), {"age": f"-{older_than_days} days"}).scalar()
+        channel_ids = hot.execute(text("SELECT id FROM channels ORDER BY id")).scalars().all()
+        for channel_id in channel_ids:
+            count = archive_channel(hot, channel_id, cutoff)
+            if count:
+                print(f"  channel {channel_id}: archived {count} messages")
+            moved += count
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old messages into the compressed archive.")
+    parser.add_argument("command", choices=["run"])
+    parser.add_argument("--older-than-days", type=int, default=ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+    print(f"Archiving messages older than {args.older_than_days} days into {database.ARCHIVE_PATH}...")
+    print(f"Done, {run(args.older_than_days)} messages archived.")
@@ -1,11 +1,19 @@
+import asyncio
 import bcrypt
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Optional
+from concurrent.futures import ProcessPoolExecutor
 from jose import JWTError, jwt
 
 SECRET_KEY = "SECRET_KEY_FOR_QUICKLINK_DEMO_ONLY" # In production, use environment variable
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000
+BCRYPT_ROUNDS = int(os.environ.get("QUICKLINK_BCRYPT_ROUNDS", "12"))
 
 def verify_password(plain_password, hashed_password):
     # Ensure bytes for bcrypt
@@ -15,11 +23,19 @@ def verify_password(plain_password, hashed_password):
         hashed_password = hashed_password.encode('utf-8')
     return bcrypt.checkpw(plain_password, hashed_password)
 
-def get_password_hash(password):
+def get_password_hash(password, rounds: Optional[int] = None):
     if isinstance(password, str):
         password = password.encode('utf-8')
     # Return string for database storage
-    return bcrypt.hashpw(password, bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)).decode('utf-8')
+
+def needs_rehash(hashed_password: str) -> bool:
+    """True when the stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    # Format: $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -30,3 +46,116 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+# Verified-token cache: skips signature checks and the user lookup on hot routes
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL_SECONDS = 300  # upper bound on how stale a cached user snapshot can be
+
+class TokenCache:
+    """Bounded LRU of token -> (claims, user snapshot), each entry expiring at
+    the earlier of the token's `exp` and TOKEN_CACHE_TTL_SECONDS."""
+
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Called with every invalidation so other workers can replay it
+        self.on_change: Optional[Callable[[dict], None]] = None
+
+    def get(self, token: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, claims, user = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return user
+
+    def put(self, token: str, claims: dict, user: Any):
+        expires_at = time.time() + self.ttl
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self._lock:
+            self._entries[token] = (expires_at, claims, user)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        """Drop every cached token whose subject is `username` (e.g. after a rename), in every worker."""
+        self.apply({"op": "invalidate_user", "username": username})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def apply(self, change: dict, notify: bool = True):
+        op = change["op"]
+        if op != "invalidate_user":
+            raise ValueError(f"Unknown token cache change: {op}")
+        with self._lock:
+            stale = [token for token, (_, claims, _) in self._entries.items() if claims.get("sub") == change["username"]]
+            for token in stale:
+                del self._entries[token]
+        if notify and self.on_change:
+            self.on_change(change)
+
+token_cache = TokenCache()
+
+
+# Password hashing pool: bcrypt runs in its own processes, never in the request threadpool
+HASH_POOL_SIZE = int(os.environ.get("QUICKLINK_HASH_POOL_SIZE", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_QUEUE_LIMIT = int(os.environ.get("QUICKLINK_HASH_QUEUE_LIMIT", str(HASH_POOL_SIZE * 8)))
+
+class HashPoolBusy(Exception):
+    """Raised when more hash jobs are waiting than HASH_QUEUE_LIMIT allows."""
+
+class PasswordHashPool:
+    """Size-bounded process pool for bcrypt with admission control.
+
+    Jobs beyond `queue_limit` (running + waiting) are rejected immediately with
+    HashPoolBusy instead of queueing, so a login storm cannot pile up work.
+    """
+
+    def __init__(self, workers: int = HASH_POOL_SIZE, queue_limit: int = HASH_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created lazily (per server worker) with spawn: forking a threaded server is unsafe
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.queue_limit:
+                raise HashPoolBusy()
+            self.pending += 1
+            executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+hash_pool = PasswordHashPool()
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    return await hash_pool.run(get_password_hash, password, BCRYPT_ROUNDS)
@@ -0,0 +1,284 @@
+"""Load test and latency benchmark for the chat hot paths.
+
+Starts the app in a subprocess on a throwaway database, opens one WebSocket per
+simulated user across M servers, posts messages through
+POST /channels/{id}/messages and measures:
+
+- post throughput and HTTP post latency
+- end-to-end post -> WebSocket delivery latency (p50 / p99 / p999)
+- DB statements per posted message
+- server memory per open WebSocket
+
+Results are written as JSON so runs can be compared:
+
+    python benchmark.py --users 500 --servers 5 --messages 5000 --output bench_results/run.json
+
+Needs `httpx` and `websockets` on top of requirements.txt.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+STATS_PATH = "/__bench/stats"
+
+
+# --- Server side (runs in the subprocess) ---
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def serve(port: int):
+    """Run the app with a statement counter and a stats route attached."""
+    import uvicorn
+    from sqlalchemy import event
+
+    import database
+    import main
+    import migrate
+
+    migrate.migrate(database.engine)
+
+    counter = {"queries": 0}
+
+    def count(*args):
+        counter["queries"] += 1
+
+    for engine in (database.engine, database.read_engine,
+                   database.async_engine.sync_engine, database.async_read_engine.sync_engine):
+        event.listen(engine, "before_cursor_execute", count)
+
+    @main.app.get(STATS_PATH, include_in_schema=False)
+    def bench_stats():
+        return {"queries": counter["queries"], "rss_bytes": _rss_bytes(),
+                "connections": len(main.manager.active_connections)}
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# --- Client side ---
+
+def percentile(values: List[float], p: float):
+    if not values:
+        return None
+    # Nearest-rank
+    values = sorted(values)
+    k = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[k]
+
+
+def summarize(values: List[float]) -> dict:
+    # Milliseconds
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p99_ms": percentile(values, 99),
+        "p999_ms": percentile(values, 99.9),
+        "max_ms": max(values) if values else None,
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+    import websockets
+
+    base = f"http://127.0.0.1:{args.port}"
+    async with httpx.AsyncClient(base_url=base, timeout=60) as client:
+        for _ in range(200):
+            try:
+                await client.get(STATS_PATH)
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError("Server did not start")
+
+        setup_limit = asyncio.Semaphore(args.concurrency)
+
+        async def post_retrying(path, **kwargs):
+            # /register and /token shed load with 503 while the bcrypt pool is full
+            while True:
+                r = await client.post(path, **kwargs)
+                if r.status_code != 503:
+                    r.raise_for_status()
+                    return r.json()
+                await asyncio.sleep(0.05)
+
+        async def register(i: int):
+            async with setup_limit:
+                name = f"bench{i}"
+                user = await post_retrying("/register", json={"username": name, "password": "pw"})
+                token = (await post_retrying("/token", data={"username": name, "password": "pw"}))["access_token"]
+                return {"id": user["id"], "headers": {"Authorization": f"Bearer {token}"}, "token": token}
+
+        print(f"Registering {args.users} users...")
+        users = await asyncio.gather(*(register(i) for i in range(args.users)))
+
+        # Server i is owned by user i; every user joins one server round-robin
+        servers = []
+        for i in range(args.servers):
+            server = (await client.post("/servers", json={"name": f"bench{i}"}, headers=users[i]["headers"])).json()
+            channels = [server["channels"][0]["id"]]
+            for c in range(1, args.channels):
+                channel = (await client.post(f"/servers/{server['id']}/channels", json={"name": f"c{c}"},
+                                             headers=users[i]["headers"])).json()
+                channels.append(channel["id"])
+            servers.append({"id": server["id"], "invite": server["invite_code"], "channels": channels, "members": [i]})
+
+        async def join(i: int):
+            server = servers[i % args.servers]
+            if i >= args.servers:
+                async with setup_limit:
+                    await client.post("/servers/join", params={"invite_code": server["invite"]}, headers=users[i]["headers"])
+                server["members"].append(i)
+
+        await asyncio.gather(*(join(i) for i in range(args.users)))
+
+        rss_before = (await client.get(STATS_PATH)).json()["rss_bytes"]
+        print(f"Opening {args.users} WebSockets...")
+        sockets = [
+            await websockets.connect(f"ws://127.0.0.1:{args.port}/ws/{u['id']}?token={u['token']}", max_queue=None)
+            for u in users
+        ]
+        await asyncio.sleep(0.5)
+        stats = (await client.get(STATS_PATH)).json()
+        rss_after = stats["rss_bytes"]
+
+        sent_at: Dict[str, float] = {}
+        delivery_ms: List[float] = []
+        expected = 0
+        delivered = asyncio.Event()
+
+        async def reader(ws):
+            try:
+                async for raw in ws:
+                    data = json.loads(raw)
+                    if data.get("type") != "new_message":
+                        continue
+                    start = sent_at.get(data["message"]["content"])
+                    if start is not None:
+                        delivery_ms.append((time.perf_counter() - start) * 1000)
+                        if len(delivery_ms) >= expected:
+                            delivered.set()
+            except websockets.ConnectionClosed:
+                pass
+
+        readers = [asyncio.create_task(reader(ws)) for ws in sockets]
+
+        plan = []
+        for seq in range(args.messages):
+            server = random.choice(servers)
+            plan.append((f"bench-{seq}", random.choice(server["channels"]), users[random.choice(server["members"])]))
+            expected += len(server["members"])
+
+        post_ms: List[float] = []
+        errors = 0
+        post_limit = asyncio.Semaphore(args.concurrency)
+
+        async def post(content, channel_id, user):
+            nonlocal errors
+            async with post_limit:
+                sent_at[content] = start = time.perf_counter()
+                r = await client.post(f"/channels/{channel_id}/messages", json={"content": content}, headers=user["headers"])
+                post_ms.append((time.perf_counter() - start) * 1000)
+                if r.status_code != 200:
+                    errors += 1
+
+        print(f"Posting {args.messages} messages ({expected} deliveries expected)...")
+        queries_before = (await client.get(STATS_PATH)).json()["queries"]
+        started = time.perf_counter()
+        await asyncio.gather(*(post(*p) for p in plan))
+        post_elapsed = time.perf_counter() - started
+        queries = (await client.get(STATS_PATH)).json()["queries"] - queries_before
+        try:
+            await asyncio.wait_for(delivered.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            print("Timed out waiting for deliveries")
+        delivery_elapsed = time.perf_counter() - started
+
+        for ws in sockets:
+            await ws.close()
+        for task in readers:
+            task.cancel()
+
+    return {
+        "config": vars(args),
+        "posts": {
+            "messages": args.messages,
+            "errors": errors,
+            "throughput_msg_per_s": args.messages / post_elapsed,
+            "latency": summarize(post_ms),
+        },
+        "delivery": {
+            "expected": expected,
+            "delivered": len(delivery_ms),
+            "throughput_deliveries_per_s": len(delivery_ms) / delivery_elapsed,
+            "latency": summarize(delivery_ms),
+        },
+        "db_queries_per_post": queries / args.messages,
+        "memory": {
+            "rss_before_ws_bytes": rss_before,
+            "rss_after_ws_bytes": rss_after,
+            "bytes_per_connection": (rss_after - rss_before) / args.users if rss_before and rss_after else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--servers", type=int, default=4)
+    parser.add_argument("--channels", type=int, default=2, help="channels per server")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="in-flight HTTP requests")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for deliveries")
+    parser.add_argument("--output", default=None, help="JSON results path (default bench_results/<time>.json)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="quicklink-bench-")
+    env = dict(
+        os.environ,
+        QUICKLINK_DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        # Registration cost is not what we measure
+        QUICKLINK_BCRYPT_ROUNDS=os.environ.get("QUICKLINK_BCRYPT_ROUNDS", "4"),
+    )
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port)],
+                              cwd=BACKEND_DIR, env=env)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    output = args.output or os.path.join("bench_results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({k: results[k] for k in ("posts", "delivery", "db_queries_per_post", "memory")}, indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
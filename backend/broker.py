@@ -0,0 +1,224 @@
+import asyncio
+import orjson
+import os
+import struct
+import tempfile
+from typing import Callable, Dict, Optional, Set
+
+# Receives one decoded event; must not block (it only enqueues to local sockets)
+EventHandler = Callable[[dict], None]
+
+# Largest event a worker will accept from the bus
+MAX_EVENT_SIZE = 1024 * 1024
+# Events buffered per peer; a peer further behind than this is disconnected and resyncs
+PEER_QUEUE_SIZE = int(os.environ.get("QUICKLINK_BROKER_PEER_QUEUE", "10000"))
+# Each frame is a 4-byte big-endian length followed by the orjson event
+_HEADER = struct.Struct("!I")
+# A zero-length frame ends a stream cleanly (the sending worker is shutting down)
+_GOODBYE = _HEADER.pack(0)
+# Handed to the local handler when events from a peer may have been lost
+GAP_EVENT = {"kind": "gap"}
+_GAP_FRAME = _HEADER.pack(len(orjson.dumps(GAP_EVENT))) + orjson.dumps(GAP_EVENT)
+
+
+class Broker:
+    """Pub/sub bus between workers: publish once, every worker's handler sees the event."""
+
+    async def start(self, handler: EventHandler):
+        self.handler = handler
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+
+class InProcessBroker(Broker):
+    """Single-worker bus: events go straight to this process' handler."""
+
+    async def publish(self, event: dict):
+        self.handler(event)
+
+
+class _Peer:
+    """Outbound stream to one other worker, fed from a bounded queue by its own task."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=PEER_QUEUE_SIZE)
+        self.task: Optional[asyncio.Task] = None
+
+
+class UnixSocketBroker(Broker):
+    """Multi-worker bus over Unix stream sockets, no external service required.
+
+    Every worker listens on `<socket_dir>/<pid>.sock` and keeps one outbound stream
+    to each other socket in the directory. Publishing delivers to the local handler
+    directly and queues the event for every peer; streams keep events in order and
+    never drop one on their own. A peer whose queue overflows is disconnected as a
+    whole and reconnected with GAP_EVENT as the first frame of the new stream, so
+    its worker resyncs instead of silently missing events. A stream that ends
+    without a goodbye frame (a crashed worker) is reported as a gap too. Sockets
+    of workers that died are unlinked on the first refused connect.
+    """
+
+    def __init__(self, socket_dir: Optional[str] = None):
+        self.socket_dir = socket_dir or os.path.join(tempfile.gettempdir(), "quicklink-bus")
+        self.path = os.path.join(self.socket_dir, f"{os.getpid()}.sock")
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._paths: Set[str] = set()
+        self._paths_mtime = None
+        self._peers: Dict[str, _Peer] = {}
+        self._readers: Set[asyncio.Task] = set()
+
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        os.makedirs(self.socket_dir, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+
+    async def stop(self):
+        if self.server is None:
+            return
+        self.server.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server = None
+        # Flush what is queued and say goodbye, so peers do not treat the shutdown as lost events
+        for peer in list(self._peers.values()):
+            try:
+                peer.queue.put_nowait(_GOODBYE)
+            except asyncio.QueueFull:
+                peer.task.cancel()
+        tasks = [peer.task for peer in self._peers.values()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=2)
+        for task in tasks + list(self._readers):
+            task.cancel()
+        self._peers.clear()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read one peer's stream until its goodbye frame."""
+        self._readers.add(asyncio.current_task())
+        try:
+            while True:
+                (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+                if size == 0:
+                    return
+                if size > MAX_EVENT_SIZE:
+                    raise ValueError(f"{size} byte event is larger than MAX_EVENT_SIZE")
+                event = orjson.loads(await reader.readexactly(size))
+                try:
+                    self.handler(event)
+                except Exception as e:
+                    print(f"Broker: handler failed for a {event.get('kind')} event: {e!r}")
+        except asyncio.CancelledError:
+            # Our own shutdown; returning keeps asyncio's stream callback from logging it
+            return
+        except (asyncio.IncompleteReadError, OSError, ValueError) as e:
+            # Peer crashed or dropped us for falling behind: whatever it sent since is lost
+            print(f"Broker: stream from a peer ended without goodbye ({e!r}), resyncing")
+            self.handler(GAP_EVENT)
+        finally:
+            self._readers.discard(asyncio.current_task())
+            writer.close()
+
+    def _refresh_peers(self):
+        # Directory mtime changes whenever a worker binds or unlinks its socket
+        mtime = os.stat(self.socket_dir).st_mtime_ns
+        if mtime == self._paths_mtime:
+            return
+        self._paths_mtime = mtime
+        self._paths = {
+            entry.path
+            for entry in os.scandir(self.socket_dir)
+            if entry.name.endswith(".sock") and entry.path != self.path
+        }
+        for path in list(self._peers):
+            if path not in self._paths:
+                self._disconnect(self._peers[path])
+
+    async def publish(self, event: dict):
+        self.handler(event)
+        if self.server is None:
+            return
+        self._refresh_peers()
+        if not self._paths:
+            return
+        data = orjson.dumps(event)
+        if len(data) > MAX_EVENT_SIZE:
+            # Callers cap what goes into events (schemas.MAX_MESSAGE_LENGTH), so this is a bug
+            print(f"Broker: dropping {len(data)} byte event, larger than MAX_EVENT_SIZE")
+            return
+        frame = _HEADER.pack(len(data)) + data
+        for path in list(self._paths):
+            peer = self._peers.get(path)
+            if peer is None or peer.task.done():
+                peer = self._connect(path)
+            try:
+                peer.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                print(f"Broker: peer {path} is {PEER_QUEUE_SIZE} events behind, reconnecting it")
+                self._disconnect(peer)
+                # The new stream opens with a gap frame, then carries on from this event
+                self._connect(path, _GAP_FRAME).queue.put_nowait(frame)
+
+    def _connect(self, path: str, *frames: bytes) -> _Peer:
+        peer = self._peers[path] = _Peer(path)
+        for frame in frames:
+            peer.queue.put_nowait(frame)
+        peer.task = asyncio.create_task(self._write_loop(peer))
+        return peer
+
+    def _disconnect(self, peer: _Peer):
+        if self._peers.get(peer.path) is peer:
+            del self._peers[peer.path]
+        peer.task.cancel()
+
+    def _forget(self, path: str):
+        # Worker is gone; forget its socket
+        self._paths.discard(path)
+        self._peers.pop(path, None)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def _write_loop(self, peer: _Peer):
+        try:
+            _, writer = await asyncio.open_unix_connection(peer.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            self._forget(peer.path)
+            return
+        except OSError as e:
+            # Retried with a new stream on the next publish
+            print(f"Broker: could not connect to peer {peer.path}: {e!r}")
+            return
+        try:
+            while True:
+                frame = await peer.queue.get()
+                writer.write(frame)
+                await writer.drain()
+                if frame is _GOODBYE:
+                    writer.close()
+                    await writer.wait_closed()
+                    return
+        except OSError as e:
+            print(f"Broker: stream to peer {peer.path} failed: {e!r}")
+        finally:
+            # Dropped or failed: abort rather than flush, the peer must see a cut stream
+            writer.transport.abort()
+
+
+def create_broker(backend: Optional[str] = None) -> Broker:
+    """Pick the bus from QUICKLINK_BROKER: "memory" (default, one worker) or "unix"."""
+    backend = backend or os.environ.get("QUICKLINK_BROKER", "memory")
+    if backend == "memory":
+        return InProcessBroker()
+    if backend == "unix":
+        return UnixSocketBroker(os.environ.get("QUICKLINK_BROKER_DIR"))
+    raise ValueError(f"Unknown broker backend: {backend}")
@@ -1,6 +1,11 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-import models, schemas, auth
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, and_, select, insert, update, exists, union_all
+from typing import Dict, List
+from datetime import datetime
+import asyncio
+import time
+import models, schemas, auth, routing, metrics, archive, message_cache
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -29,8 +34,12 @@ def get_servers(db: Session, user_id: int):
     # Get servers the user is a member of OR owner of
     # For simplicity, we just return all servers the user is a member of
     # And we ensure owner is automatically a member
-    user = get_user(db, user_id)
-    return user.servers
+    # Channels are batch-loaded (one extra query total, not one per server)
+    member_of = select(models.server_members.c.server_id).where(models.server_members.c.user_id == user_id)
+    stmt = select(models.Server).where(models.Server.id.in_(member_of)).options(
+        selectinload(models.Server.channels)
+    ).order_by(models.Server.id)
+    return db.execute(stmt).scalars().all()
 
 import uuid
 
@@ -51,6 +60,8 @@ def create_server(db: Session, server: schemas.ServerCreate, user_id: int):
     
     db.commit()
     db.refresh(db_server)
+    routing.index.add_member(db_server.id, user_id)
+    routing.index.add_channel(default_channel.id, db_server.id)
     return db_server
 
 def get_server_channels(db: Session, server_id: int):
@@ -61,42 +72,277 @@ def create_channel(db: Session, channel: schemas.ChannelCreate, server_id: int):
     db.add(db_channel)
     db.commit()
     db.refresh(db_channel)
+    routing.index.add_channel(db_channel.id, server_id)
     return db_channel
 
-def get_channel_messages(db: Session, channel_id: int, limit: int = 50):
-    return db.query(models.Message).filter(models.Message.channel_id == channel_id).order_by(models.Message.timestamp.desc()).limit(limit).all()
+MAX_MESSAGE_PAGE_SIZE = 100
+
+def _cursor_filter(channel_id: int, cursor_id: int, newer: bool):
+    """Rows after (or before) message `cursor_id` in (timestamp, id) order."""
+    # Compare against the stored timestamp inside SQL so the cursor row's
+    # value never round-trips through Python datetime formatting
+    cursor_ts = select(models.Message.timestamp).where(
+        models.Message.id == cursor_id, models.Message.channel_id == channel_id
+    ).scalar_subquery()
+    if newer:
+        return or_(models.Message.timestamp > cursor_ts,
+                   and_(models.Message.timestamp == cursor_ts, models.Message.id > cursor_id))
+    return or_(models.Message.timestamp < cursor_ts,
+               and_(models.Message.timestamp == cursor_ts, models.Message.id < cursor_id))
+
+def _channel_messages_statement(channel_id: int, limit: int, before: int = None, after: int = None):
+    """Build the keyset page query shared by the sync and async readers.
+
+    Returns (statement, reverse): `after` pages are fetched oldest-first and must
+    be flipped back to newest-first by the caller.
+    """
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    stmt = select(models.Message).options(selectinload(models.Message.sender)).where(
+        models.Message.channel_id == channel_id
+    )
+
+    if after is not None and before is None:
+        # Walk forward from the cursor
+        stmt = stmt.where(_cursor_filter(channel_id, after, newer=True)).order_by(
+            models.Message.timestamp.asc(), models.Message.id.asc()
+        )
+        return stmt.limit(limit), True
+
+    if before is not None:
+        stmt = stmt.where(_cursor_filter(channel_id, before, newer=False))
+    return stmt.order_by(models.Message.timestamp.desc(), models.Message.id.desc()).limit(limit), False
+
+# --- Archived history (see archive.py) ---
+
+def _cursor_exists_statement(channel_id: int, message_id: int):
+    return select(exists().where(models.Message.id == message_id, models.Message.channel_id == channel_id))
+
+def _oldest_messages_statement(channel_id: int, limit: int):
+    return select(models.Message).options(selectinload(models.Message.sender)).where(
+        models.Message.channel_id == channel_id
+    ).order_by(models.Message.timestamp.asc(), models.Message.id.asc()).limit(limit)
+
+def _senders_statement(rows: List[archive.Row]):
+    return select(models.User).where(models.User.id.in_({row[2] for row in rows}))
+
+def _read_archive(channel_id: int, have: int, limit: int, before: int, after: int, cursor_in_hot: bool):
+    """Archived rows completing a short hot page of `have` messages.
+
+    Returns (rows newest first, hot_tail): hot_tail > 0 when an `after` cursor is
+    archived and the page continues with that many of the oldest hot messages.
+    Everything archived is older than everything still hot.
+    """
+    if not cursor_in_hot:
+        # The cursor itself was archived (an unknown id reads nothing from either tier)
+        if after is None:
+            return archive.read_before(channel_id, before, limit), 0
+        rows = archive.read_after(channel_id, after, limit)
+        hot_tail = limit - len(rows) if rows or archive.contains(channel_id, after) else 0
+        return rows[::-1], hot_tail
+    if after is None:
+        # Hot history ran out: continue with the newest archived messages
+        return archive.read_before(channel_id, None, limit - have), 0
+    return [], 0
+
+def _merge_archived(channel_id: int, messages: list, rows: List[archive.Row], senders: Dict[int, models.User]):
+    """Hot messages (newest first) followed by the older archived rows."""
+    archived = [
+        schemas.Message(
+            id=message_id, content=content, timestamp=datetime.fromisoformat(timestamp), user_id=user_id,
+            channel_id=channel_id, sender=schemas.User.model_validate(senders[user_id]),
+        )
+        for message_id, timestamp, user_id, content in rows if user_id in senders
+    ]
+    return list(messages) + archived
+
+def get_channel_messages(db: Session, channel_id: int, limit: int = 50, before: int = None, after: int = None):
+    """Page through a channel's history, newest first.
+
+    `before` / `after` are message ids used as keyset cursors, so a page deep in
+    the history costs the same index seek as the latest page. Pages that run past
+    the hot table continue into the cold archive.
+    """
+    stmt, reverse = _channel_messages_statement(channel_id, limit, before, after)
+    messages = db.execute(stmt).scalars().all()
+    messages = list(reversed(messages)) if reverse else messages
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    if len(messages) >= limit or not archive.enabled():
+        return messages
+    # Short page: the rest of the history may be in the cold archive
+    cursor = before if after is None else after
+    cursor_in_hot = bool(messages) or cursor is None or db.execute(_cursor_exists_statement(channel_id, cursor)).scalar()
+    rows, hot_tail = _read_archive(channel_id, len(messages), limit, before, after, cursor_in_hot)
+    if hot_tail:
+        messages = list(reversed(db.execute(_oldest_messages_statement(channel_id, hot_tail)).scalars().all()))
+    senders = {u.id: u for u in db.execute(_senders_statement(rows)).scalars()} if rows else {}
+    return _merge_archived(channel_id, messages, rows, senders)
 
 def create_message(db: Session, message: schemas.MessageCreate, user_id: int, channel_id: int):
     db_message = models.Message(**message.dict(), user_id=user_id, channel_id=channel_id)
     db.add(db_message)
+    start = time.perf_counter()
     db.commit()
+    metrics.message_commit_seconds.observe(time.perf_counter() - start)
+    metrics.message_commit_batch.observe(1)
     db.refresh(db_message)
     return db_message
 
+# --- Async variants for routes that run on the event loop ---
+
+async def get_user_by_username_async(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    return result.scalars().first()
+
+async def create_user_async(db: AsyncSession, username: str, hashed_password: str):
+    # The password is hashed by the caller (off-loop, in auth.hash_pool)
+    db_user = models.User(username=username, hashed_password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def update_password_hash_async(db: AsyncSession, user_id: int, hashed_password: str):
+    await db.execute(update(models.User).where(models.User.id == user_id).values(hashed_password=hashed_password))
+    await db.commit()
+
+async def get_channel_messages_async(db: AsyncSession, channel_id: int, limit: int = 50, before: int = None, after: int = None):
+    stmt, reverse = _channel_messages_statement(channel_id, limit, before, after)
+    messages = (await db.execute(stmt)).scalars().all()
+    messages = list(reversed(messages)) if reverse else messages
+    limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+    if len(messages) >= limit or not archive.enabled():
+        return messages
+    cursor = before if after is None else after
+    cursor_in_hot = bool(messages) or cursor is None or (await db.execute(_cursor_exists_statement(channel_id, cursor))).scalar()
+    # Archive reads are blocking SQLite calls on a separate file
+    rows, hot_tail = await asyncio.to_thread(_read_archive, channel_id, len(messages), limit, before, after, cursor_in_hot)
+    if hot_tail:
+        messages = list(reversed((await db.execute(_oldest_messages_statement(channel_id, hot_tail))).scalars().all()))
+    senders = {u.id: u for u in (await db.execute(_senders_statement(rows))).scalars()} if rows else {}
+    return _merge_archived(channel_id, messages, rows, senders)
+
+MAX_SYNC_CHANNELS = 200
+
+async def get_messages_since_async(db: AsyncSession, cursors: Dict[int, int], limit_per_channel: int = MAX_MESSAGE_PAGE_SIZE):
+    """Everything newer than each channel's last-seen message id, in one statement.
+
+    Each channel contributes an index-seeking branch capped at `limit_per_channel`
+    (last-seen 0 means "nothing seen": the latest page). Returns (messages oldest
+    first per channel, ids of channels that had more than the cap).
+    """
+    if not cursors:
+        return [], []
+    branches = []
+    for channel_id, last_seen in cursors.items():
+        branch = select(models.Message.id, models.Message.channel_id).where(models.Message.channel_id == channel_id)
+        if last_seen > 0:
+            branch = branch.where(_cursor_filter(channel_id, last_seen, newer=True)).order_by(
+                models.Message.timestamp.asc(), models.Message.id.asc()
+            )
+        else:
+            branch = branch.order_by(models.Message.timestamp.desc(), models.Message.id.desc())
+        # One extra row tells us whether the channel was truncated
+        sub = branch.limit(limit_per_channel + 1).subquery()
+        branches.append(select(sub.c.id, sub.c.channel_id))
+    rows = (await db.execute(union_all(*branches))).all()
+
+    per_channel: Dict[int, List[int]] = {}
+    for message_id, channel_id in rows:
+        per_channel.setdefault(channel_id, []).append(message_id)
+    truncated = []
+    if archive.enabled():
+        # A cursor that was archived since matches nothing above; have the client page on with `after`
+        quiet = {c: last_seen for c, last_seen in cursors.items() if last_seen > 0 and c not in per_channel}
+        if quiet:
+            truncated.extend(await asyncio.to_thread(archive.archived_cursors, quiet))
+    keep = []
+    for channel_id, ids in per_channel.items():
+        if len(ids) > limit_per_channel:
+            truncated.append(channel_id)
+            # Newer-than branches keep the oldest rows (contiguous after the cursor); latest-page branches the newest
+            ids = ids[:limit_per_channel]
+        keep.extend(ids)
+    if not keep:
+        return [], truncated
+    messages = (await db.execute(
+        select(models.Message).options(selectinload(models.Message.sender)).where(models.Message.id.in_(keep)).order_by(
+            models.Message.channel_id, models.Message.timestamp, models.Message.id
+        )
+    )).scalars().all()
+    return messages, truncated
+
+async def create_messages_async(db: AsyncSession, rows: List[dict]):
+    """Insert many messages in one transaction (one fsync).
+
+    `rows` are dicts of content / user_id / channel_id; returns (id, timestamp)
+    rows in the same order.
+    """
+    # Without sort_by_parameter_order SQLAlchemy sends one multi-row INSERT ... RETURNING;
+    # SQLite hands out rowids in VALUES order, so ascending ids line up with `rows`
+    stmt = insert(models.Message).returning(models.Message.id, models.Message.timestamp)
+    start = time.perf_counter()
+    result = sorted((await db.execute(stmt, rows)).all(), key=lambda row: row.id)
+    await db.commit()
+    metrics.message_commit_seconds.observe(time.perf_counter() - start)
+    metrics.message_commit_batch.observe(len(rows))
+    return result
+
+def is_server_member(db: Session, server_id: int, user_id: int) -> bool:
+    # Single probe of ux_server_members_server_user, whatever the server size
+    members = models.server_members.c
+    return db.execute(
+        select(exists().where(members.server_id == server_id, members.user_id == user_id))
+    ).scalar()
+
+def _add_member(db: Session, server: models.Server, user_id: int):
+    if not is_server_member(db, server.id, user_id):
+        db.execute(insert(models.server_members).values(server_id=server.id, user_id=user_id))
+        db.commit()
+        routing.index.add_member(server.id, user_id)
+
 def join_server(db: Session, server_id: int, user_id: int):
     server = db.query(models.Server).filter(models.Server.id == server_id).first()
     user = get_user(db, user_id)
     if server and user:
-        if user not in server.members:
-            server.members.append(user)
-            db.commit()
+        _add_member(db, server, user_id)
     return server
 
 def join_server_by_invite(db: Session, invite_code: str, user_id: int):
     server = db.query(models.Server).filter(models.Server.invite_code == invite_code).first()
     user = get_user(db, user_id)
     if server and user:
-        if user not in server.members:
-            server.members.append(user)
-            db.commit()
+        _add_member(db, server, user_id)
     return server
 
+MAX_MEMBER_PAGE_SIZE = 500
+
+def get_server_members(db: Session, server_id: int, limit: int = 100, after: int = None):
+    """Page through a server's members by user id; `after` is the last id of the previous page."""
+    limit = max(1, min(limit, MAX_MEMBER_PAGE_SIZE))
+    members = models.server_members.c
+    stmt = select(models.User).join(models.server_members, members.user_id == models.User.id).where(
+        members.server_id == server_id
+    )
+    if after is not None:
+        stmt = stmt.where(members.user_id > after)
+    return db.execute(stmt.order_by(members.user_id).limit(limit)).scalars().all()
+
 def delete_server(db: Session, server_id: int):
     db_server = db.query(models.Server).filter(models.Server.id == server_id).first()
     if db_server:
+        channel_ids = [c.id for c in db_server.channels]
         db.delete(db_server)
         db.commit()
+        routing.index.remove_server(server_id)
+        message_cache.cache.discard_channels(channel_ids)
+        archive.drop_channels(channel_ids)
     return db_server
 
-def get_all_servers(db: Session):
-    return db.query(models.Server).all()
+MAX_SERVER_PAGE_SIZE = 200
+
+def get_all_servers(db: Session, limit: int = 100, after: int = None):
+    """Page through all servers by id; `after` is the last id of the previous page."""
+    limit = max(1, min(limit, MAX_SERVER_PAGE_SIZE))
+    stmt = select(models.Server.id, models.Server.name, models.Server.owner_id)
+    if after is not None:
+        stmt = stmt.where(models.Server.id > after)
+    return db.execute(stmt.order_by(models.Server.id).limit(limit)).all()
@@ -1,14 +1,74 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./quicklink.db"
-
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+# Default next to this file, so the DB no longer depends on the working directory
+DEFAULT_DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quicklink.db")
+SQLALCHEMY_DATABASE_URL = os.environ.get("QUICKLINK_DATABASE_URL", f"sqlite:///{DEFAULT_DATABASE_PATH}")
+# Same database through aiosqlite, for routes that run on the event loop
+ASYNC_SQLALCHEMY_DATABASE_URL = os.environ.get(
+    "QUICKLINK_ASYNC_DATABASE_URL",
+    SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1),
 )
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# SQLite storage profile, applied to every new connection
+SQLITE_JOURNAL_MODE = os.environ.get("QUICKLINK_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_PRAGMAS = {
+    # NORMAL is durable across app crashes in WAL mode; only an OS crash can lose the last commits
+    "synchronous": os.environ.get("QUICKLINK_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("QUICKLINK_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.environ.get("QUICKLINK_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative means KiB: 64 MiB page cache per connection
+    "cache_size": int(os.environ.get("QUICKLINK_SQLITE_CACHE_SIZE", str(-64 * 1024))),
+    "temp_store": "MEMORY",
+}
+# Connections in the read-only pool (history and listing routes)
+READ_POOL_SIZE = int(os.environ.get("QUICKLINK_READ_POOL_SIZE", "8"))
+
+def _apply_sqlite_profile(sync_engine, read_only: bool):
+    @event.listens_for(sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # journal_mode is persistent in the file; the writer side sets it
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+# expire_on_commit=False: attributes stay readable after commit without an implicit (sync) reload
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Read-only pools: in WAL mode readers never wait on the writer
+read_engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args, pool_size=READ_POOL_SIZE)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+async_read_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, pool_size=READ_POOL_SIZE)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+if IS_SQLITE:
+    _apply_sqlite_profile(engine, read_only=False)
+    _apply_sqlite_profile(async_engine.sync_engine, read_only=False)
+    _apply_sqlite_profile(read_engine, read_only=True)
+    _apply_sqlite_profile(async_read_engine.sync_engine, read_only=True)
+
+# Cold message archive (see archive.py): a separate SQLite file, by default next to the main one
+_main_db_path = SQLALCHEMY_DATABASE_URL[len("sqlite:///"):] if SQLALCHEMY_DATABASE_URL.startswith("sqlite:///") else DEFAULT_DATABASE_PATH
+ARCHIVE_PATH = os.environ.get("QUICKLINK_ARCHIVE_PATH", os.path.splitext(_main_db_path)[0] + "_archive.db")
+archive_engine = create_engine(f"sqlite:///{ARCHIVE_PATH}", connect_args={"check_same_thread": False})
+_apply_sqlite_profile(archive_engine, read_only=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -17,3 +77,11 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
@@ -0,0 +1,91 @@
+import asyncio
+import os
+from typing import List, Optional, Tuple
+
+import crud, database
+
+# Group commit: the writer waits up to this long for more messages before committing
+INGEST_MAX_DELAY_MS = float(os.environ.get("QUICKLINK_INGEST_MAX_DELAY_MS", "2"))
+INGEST_BATCH_SIZE = int(os.environ.get("QUICKLINK_INGEST_BATCH_SIZE", "256"))
+# Messages waiting for a commit; beyond this, sends are rejected instead of queued
+INGEST_QUEUE_LIMIT = int(os.environ.get("QUICKLINK_INGEST_QUEUE_LIMIT", "10000"))
+
+
+class IngestBusy(Exception):
+    """Raised when INGEST_QUEUE_LIMIT messages are already waiting; nothing was saved."""
+
+
+class MessageIngest:
+    """Write-behind stage that persists messages in batches, one transaction per batch.
+
+    Callers `await submit(...)` and get back the persisted (id, timestamp) once the
+    batch containing their message has committed. A full queue raises IngestBusy
+    right away, so overload turns into fast rejections rather than growing latency.
+    """
+
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE, max_delay_ms: float = INGEST_MAX_DELAY_MS,
+                 queue_limit: int = INGEST_QUEUE_LIMIT):
+        self.batch_size = batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.queue_limit = queue_limit
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.queue = self.queue or asyncio.Queue(maxsize=self.queue_limit)
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Commit whatever is still queued, then stop the writer."""
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def submit(self, content: str, user_id: int, channel_id: int):
+        # Started lazily so the stage also works when the app lifespan did not run
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(({"content": content, "user_id": user_id, "channel_id": channel_id}, future))
+        except asyncio.QueueFull:
+            raise IngestBusy()
+        return await future
+
+    def _take(self, limit: int) -> List[Tuple[dict, asyncio.Future]]:
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            first = await self.queue.get()
+            if self.max_delay > 0 and self.queue.qsize() < self.batch_size - 1:
+                # Bounded wait so a burst lands in the same transaction
+                await asyncio.sleep(self.max_delay)
+            await self._flush([first] + self._take(self.batch_size - 1))
+
+    async def _flush(self, batch: List[Tuple[dict, asyncio.Future]]):
+        try:
+            async with database.AsyncSessionLocal() as db:
+                persisted = await crud.create_messages_async(db, [row for row, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+                self.queue.task_done()
+            return
+        for (_, future), row in zip(batch, persisted):
+            if not future.done():
+                future.set_result(row)
+            self.queue.task_done()
+
+
+writer = MessageIngest()
@@ -1,44 +1,33 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from typing import List, Dict
-import json
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Optional, FrozenSet
+from pydantic import ValidationError
+import orjson
+import asyncio
+import time
+from contextlib import asynccontextmanager
 
-import models, schemas, crud, auth, database
-from sqlalchemy import text
+import models, schemas, crud, auth, database, broker, routing, ingest, message_cache, search, metrics, migrate, presence
 
-# Init DB and Auto Migrate
-models.Base.metadata.create_all(bind=database.engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Migrations run separately (`python migrate.py`), never from the workers
+    migrate.check_current(database.engine)
+    with database.SessionLocal() as db:
+        routing.index.rebuild(db)
+    await manager.start()
+    ingest.writer.start()
+    yield
+    await ingest.writer.stop()
+    await manager.stop()
+    auth.hash_pool.shutdown()
+    await database.async_engine.dispose()
+    await database.async_read_engine.dispose()
 
-def check_and_migrate_db(engine):
-    with engine.connect() as conn:
-        try:
-            # Check invite_code column in servers
-            result = conn.execute(text("PRAGMA table_info(servers)"))
-            columns = [row[1] for row in result.fetchall()]
-            
-            if 'invite_code' not in columns:
-                print("Migrating database: Adding invite_code to servers table...")
-                conn.execute(text("ALTER TABLE servers ADD COLUMN invite_code VARCHAR"))
-                conn.execute(text("CREATE UNIQUE INDEX ix_servers_invite_code ON servers (invite_code)"))
-                
-                # Backfill UUIDs
-                import uuid
-                rows = conn.execute(text("SELECT id FROM servers")).fetchall()
-                for row in rows:
-                    server_id = row[0]
-                    code = str(uuid.uuid4())
-                    conn.execute(text("UPDATE servers SET invite_code = :code WHERE id = :id"), {"code": code, "id": server_id})
-                
-                conn.commit()
-                print("Migration completed.")
-        except Exception as e:
-            print(f"Migration check failed or skipped: {e}")
-
-check_and_migrate_db(database.engine)
-
-app = FastAPI(title="QuickLink Discord Clone")
+app = FastAPI(title="QuickLink Discord Clone", lifespan=lifespan)
 
 # CORS
 app.add_middleware(
@@ -48,6 +37,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+for _engine in (database.engine, database.read_engine,
+                database.async_engine.sync_engine, database.async_read_engine.sync_engine):
+    metrics.instrument_engine(_engine)
 
 # Dependency
 def get_db():
@@ -57,96 +50,314 @@ def get_db():
     finally:
         db.close()
 
+# Read-only session for history and listing routes
+def get_read_db():
+    db = database.ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def resolve_token(token: str, db: AsyncSession) -> Optional[schemas.User]:
+    """Token -> detached user snapshot (id, username), or None if it does not authenticate."""
+    cached = auth.token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
         payload = auth.jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except auth.JWTError:
-        raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+        return None
+    username: str = payload.get("sub")
+    if username is None:
+        return None
+    user = await crud.get_user_by_username_async(db, username=username)
+    if user is None:
+        return None
+    snapshot = schemas.User.model_validate(user)
+    auth.token_cache.put(token, payload, snapshot)
+    return snapshot
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_read_db)) -> schemas.User:
+    # Returns a detached snapshot (id, username), not an ORM object
+    user = await resolve_token(token, db)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 # WebSocket Manager
+WS_SEND_QUEUE_SIZE = 256  # frames buffered per socket before it is treated as a slow consumer
+
+class ClientConnection:
+    """A socket plus its bounded outbound queue, drained by a dedicated writer task."""
+
+    def __init__(self, websocket: WebSocket, user_id: int, queue_size: int = WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        # Connected with a valid token for user_id; only these count towards presence
+        self.authenticated = False
+
+    def start(self, on_failure):
+        self.writer = asyncio.create_task(self._write_loop(on_failure))
+
+    async def _write_loop(self, on_failure):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Broken pipe / closed socket: unregister so broadcasts stop targeting it
+            metrics.ws_send_failures.inc(reason="error")
+            on_failure(self)
+
+    def send(self, message: dict) -> bool:
+        return self.send_frame(orjson.dumps(message).decode())
+
+    def send_frame(self, frame: str) -> bool:
+        """Enqueue an encoded frame without waiting; False means the client is not keeping up."""
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            metrics.ws_send_failures.inc(reason="overflow")
+            return False
+
+    async def close(self, code: int = status.WS_1000_NORMAL_CLOSURE):
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
 class ConnectionManager:
-    def __init__(self):
-        # user_id -> WebSocket
-        self.active_connections: Dict[int, WebSocket] = {}
+    """Holds this worker's sockets; cross-worker delivery goes through the broker."""
+
+    def __init__(self, bus: Optional[broker.Broker] = None):
+        # user_id -> ClientConnection
+        self.active_connections: Dict[int, ClientConnection] = {}
+        self.bus = bus or broker.InProcessBroker()
+        self.presence = presence.PresenceHub(self.bus.publish, self.active_connections)
+        self._rebuild_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await self.bus.start(self._on_event)
+        self.presence.start()
+        if not isinstance(self.bus, broker.InProcessBroker):
+            # Membership changes made in this worker must reach the other workers' indexes
+            loop = asyncio.get_running_loop()
+            routing.index.on_change = lambda change: loop.call_soon_threadsafe(
+                asyncio.ensure_future, self.bus.publish({"kind": "routing", "change": change})
+            )
+            # Same for message cache invalidations (renames, deleted channels)
+            message_cache.cache.on_change = lambda change: loop.call_soon_threadsafe(
+                asyncio.ensure_future, self.bus.publish({"kind": "message_cache", "change": change})
+            )
+            # And token invalidations, or other workers keep accepting a renamed user's old tokens
+            auth.token_cache.on_change = lambda change: loop.call_soon_threadsafe(
+                asyncio.ensure_future, self.bus.publish({"kind": "token_cache", "change": change})
+            )
+            if routing.REBUILD_SECONDS > 0:
+                self._rebuild_task = asyncio.create_task(self._rebuild_routing())
+
+    async def stop(self):
+        if self._rebuild_task:
+            self._rebuild_task.cancel()
+        await self.presence.stop()
+        await self.bus.stop()
+
+    async def _rebuild_routing(self):
+        """Periodically reload the routing index so a lost change event is eventually corrected."""
+        while True:
+            await asyncio.sleep(routing.REBUILD_SECONDS)
+            await self._reload_routing()
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    async def _reload_routing(self, attempts: int = 3):
+        def rebuild():
+            with database.ReadSessionLocal() as db:
+                return routing.index.rebuild(db)
+
+        try:
+            # False means it raced a live change; load again so the snapshot is not stale
+            for _ in range(attempts):
+                if await asyncio.to_thread(rebuild):
+                    return
+        except Exception as e:
+            print(f"Routing index rebuild failed: {e}")
+
+    def _resync(self):
+        """Events from another worker may have been lost: reload shared state, have clients catch up."""
+        asyncio.ensure_future(self._reload_routing())
+        # Rings may lack messages from the lost events; reload them from the DB on next read
+        message_cache.cache.clear()
+        # A lost invalidation would keep a renamed user's old tokens valid until they expire
+        auth.token_cache.clear()
+        for conn in list(self.active_connections.values()):
+            conn.send({"type": "resync"})
+
+    async def connect(self, websocket: WebSocket, user_id: int, authenticated: bool = False) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        conn = ClientConnection(websocket, user_id)
+        conn.authenticated = authenticated
+        previous = self.active_connections.get(user_id)
+        self.active_connections[user_id] = conn
+        conn.start(self._drop)
+        if previous:
+            # One socket per user: the newer session replaces the old one
+            asyncio.create_task(previous.close())
+        was_online = previous is not None and previous.authenticated
+        if authenticated and not was_online:
+            await self.presence.connected(user_id)
+        elif was_online and not authenticated:
+            self.presence.disconnected(user_id)
+        return conn
+
+    def disconnect(self, user_id: int, conn: Optional[ClientConnection] = None):
+        current = self.active_connections.get(user_id)
+        if current is None or (conn is not None and current is not conn):
+            return
+        del self.active_connections[user_id]
+        if current.writer:
+            current.writer.cancel()
+        if current.authenticated:
+            self.presence.disconnected(user_id)
+        else:
+            self.presence.view(user_id, None)
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
+    def _drop(self, conn: ClientConnection, code: int = status.WS_1011_INTERNAL_ERROR):
+        self.disconnect(conn.user_id, conn)
+        asyncio.create_task(conn.close(code))
 
-    async def broadcast_to_server_members(self, message: dict, member_ids: List[int]):
-        """Send message to all connected members of the server"""
-        for uid in member_ids:
-            if uid in self.active_connections:
-                try:
-                    await self.active_connections[uid].send_json(message)
-                except:
-                    # Handle broken pipe
-                    pass
+    async def broadcast_to_server(self, message: dict, server_id: int):
+        """Publish once; every worker delivers to the server members connected to it"""
+        await self.bus.publish({"kind": "broadcast", "server_id": server_id, "message": message})
 
-manager = ConnectionManager()
+    def _on_event(self, event: dict):
+        if event["kind"] == "gap":
+            self._resync()
+        elif event["kind"] == "routing":
+            routing.index.apply(event["change"], notify=False)
+        elif event["kind"] == "message_cache":
+            message_cache.cache.apply(event["change"], notify=False)
+        elif event["kind"] == "token_cache":
+            auth.token_cache.apply(event["change"], notify=False)
+        elif event["kind"] in ("presence", "presence_snapshot", "typing"):
+            # Folded into the next presence tick, not sent per event
+            self.presence.apply(event)
+        else:
+            if event["message"].get("type") == "new_message":
+                # Every worker sees every new message here, so each keeps its ring buffer current
+                message_cache.cache.add(event["message"]["message"])
+            self.deliver_local(event["message"], routing.index.members_of(event["server_id"]))
+
+    def deliver_local(self, message: dict, member_ids: FrozenSet[int]):
+        """Queue message for members connected to this worker without waiting on any socket"""
+        start = time.perf_counter()
+        # Encode once per event; every recipient gets the same frame
+        frame = orjson.dumps(message).decode()
+        # Walk whichever side is smaller: a big server with few local sockets, or the reverse
+        if len(self.active_connections) < len(member_ids):
+            targets = [conn for uid, conn in self.active_connections.items() if uid in member_ids]
+        else:
+            targets = [self.active_connections[uid] for uid in member_ids if uid in self.active_connections]
+        for conn in targets:
+            if not conn.send_frame(frame):
+                # Queue overflowed: disconnect rather than let it hold back everyone else
+                self._drop(conn, status.WS_1013_TRY_AGAIN_LATER)
+        metrics.broadcast_recipients.inc(len(targets))
+        metrics.broadcast_seconds.observe(time.perf_counter() - start)
+
+manager = ConnectionManager(broker.create_broker())
+metrics.Gauge("quicklink_ws_active_connections", "WebSockets connected to this worker",
+              lambda: len(manager.active_connections))
 
 # --- Auth Routes ---
+# Both routes await bcrypt in auth.hash_pool; a full pool answers 503 instead of queueing
+def hash_pool_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
 @app.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
+    db_user = await crud.get_user_by_username_async(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    try:
+        hashed_password = await auth.get_password_hash_async(user.password)
+    except auth.HashPoolBusy:
+        raise hash_pool_busy()
+    return await crud.create_user_async(db, username=user.username, hashed_password=hashed_password)
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    user = await crud.get_user_by_username_async(db, username=form_data.username)
+    try:
+        valid = bool(user) and await auth.verify_password_async(form_data.password, user.hashed_password)
+    except auth.HashPoolBusy:
+        raise hash_pool_busy()
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if auth.needs_rehash(user.hashed_password):
+        # Cost changed since this hash was made: upgrade it while we have the password
+        try:
+            new_hash = await auth.get_password_hash_async(form_data.password)
+            await crud.update_password_hash_async(db, user.id, new_hash)
+        except auth.HashPoolBusy:
+            pass  # Retried on a later login
     access_token = auth.create_access_token(data={"sub": user.username})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(get_current_user)):
+def read_users_me(current_user: schemas.User = Depends(get_current_user)):
     return current_user
 
 @app.patch("/users/me", response_model=schemas.User)
-def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def update_user_me(user_update: schemas.UserUpdate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     if user_update.username:
         # Check if username exists
         existing_user = crud.get_user_by_username(db, user_update.username)
         if existing_user and existing_user.id != current_user.id:
             raise HTTPException(status_code=400, detail="Username already taken")
-    return crud.update_user(db, current_user.id, username=user_update.username)
+    user = crud.update_user(db, current_user.id, username=user_update.username)
+    if user_update.username and user_update.username != current_user.username:
+        # Tokens carry the username as `sub`; cached entries for the old name must go (every worker)
+        auth.token_cache.invalidate_user(current_user.username)
+        # Cached messages embed the sender's username (every worker's cache)
+        message_cache.cache.invalidate()
+    return user
 
 # --- Server/Channel Routes ---
 @app.get("/servers", response_model=List[schemas.Server])
-def read_servers(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_servers(db: Session = Depends(get_read_db), current_user: schemas.User = Depends(get_current_user)):
     return crud.get_servers(db, user_id=current_user.id)
 
-@app.get("/servers/all", response_model=List[schemas.Server])
-def read_all_servers(db: Session = Depends(get_db)):
-    return crud.get_all_servers(db)
+@app.get("/servers/all", response_model=List[schemas.ServerSummary])
+def read_all_servers(
+    limit: int = Query(100, ge=1, le=crud.MAX_SERVER_PAGE_SIZE),
+    after: Optional[int] = None,
+    db: Session = Depends(get_read_db)
+):
+    # Cursor paging: pass the last server id of the previous page as `after`
+    return crud.get_all_servers(db, limit=limit, after=after)
 
 @app.post("/servers", response_model=schemas.Server)
-def create_server(server: schemas.ServerCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_server(server: schemas.ServerCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     return crud.create_server(db=db, server=server, user_id=current_user.id)
 
 @app.post("/servers/join")
@@ -154,7 +365,7 @@ def join_server(
     invite_code: str = None, 
     server_id: int = None,
     db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+    current_user: schemas.User = Depends(get_current_user)
 ):
     server = None
     if invite_code:
@@ -169,7 +380,7 @@ def join_server(
     return {"status": "joined", "server": server.name}
 
 @app.delete("/servers/{server_id}")
-def delete_server(server_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def delete_server(server_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     server = db.query(models.Server).filter(models.Server.id == server_id).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
@@ -179,7 +390,7 @@ def delete_server(server_id: int, db: Session = Depends(get_db), current_user: m
     return {"status": "deleted"}
 
 @app.post("/servers/{server_id}/channels", response_model=schemas.Channel)
-def create_channel(server_id: int, channel: schemas.ChannelCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def create_channel(server_id: int, channel: schemas.ChannelCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
     # Check if user is owner or member? For now let's say anyone in server can create channel or just owner
     # For simplicity: owner only
     server = db.query(models.Server).filter(models.Server.id == server_id).first()
@@ -190,62 +401,258 @@ def create_channel(server_id: int, channel: schemas.ChannelCreate, db: Session =
     return crud.create_channel(db=db, channel=channel, server_id=server_id)
 
 @app.get("/servers/{server_id}/channels", response_model=List[schemas.Channel])
-def read_channels(server_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_channels(server_id: int, db: Session = Depends(get_read_db), current_user: schemas.User = Depends(get_current_user)):
     return crud.get_server_channels(db, server_id=server_id)
 
 @app.get("/servers/{server_id}/members", response_model=List[schemas.User])
-def read_server_members(server_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def read_server_members(
+    server_id: int,
+    limit: int = Query(100, ge=1, le=crud.MAX_MEMBER_PAGE_SIZE),
+    after: Optional[int] = None,
+    db: Session = Depends(get_read_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
     server = db.query(models.Server).filter(models.Server.id == server_id).first()
     if not server:
         raise HTTPException(status_code=404, detail="Server not found")
     # Check if user is member
-    if current_user not in server.members:
+    if not crud.is_server_member(db, server_id, current_user.id):
         raise HTTPException(status_code=403, detail="Not authorized")
-    return server.members
+    # Cursor paging: pass the last user id of the previous page as `after`
+    return crud.get_server_members(db, server_id, limit=limit, after=after)
 
 # --- Message Routes ---
 @app.get("/channels/{channel_id}/messages", response_model=List[schemas.Message])
-def read_messages(channel_id: int, limit: int = 50, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    messages = crud.get_channel_messages(db, channel_id=channel_id, limit=limit)
+async def read_messages(
+    channel_id: int,
+    limit: int = Query(50, ge=1, le=crud.MAX_MESSAGE_PAGE_SIZE),
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    # `before` pages back into history, `after` fetches what is newer than a known message
+    if before is None and after is None and limit <= message_cache.RING_SIZE:
+        # Latest page: served from the hot-channel ring buffer when possible
+        cached = message_cache.cache.get_latest(channel_id, limit)
+        if cached is None and routing.index.server_for_channel(channel_id) is not None:
+            token = message_cache.cache.begin_fill(channel_id)
+            try:
+                messages = await crud.get_channel_messages_async(db, channel_id=channel_id, limit=message_cache.RING_SIZE)
+                serialized = [schemas.Message.model_validate(m).model_dump(mode="json") for m in messages]
+                message_cache.cache.finish_fill(channel_id, token, serialized)
+            finally:
+                # Failed or cancelled reads must not keep collecting broadcasts
+                message_cache.cache.abandon_fill(channel_id, token)
+            cached = serialized[:limit]
+        if cached is not None:
+            # Already JSON-ready: encode directly instead of re-validating against the response model
+            return Response(orjson.dumps(cached), media_type="application/json")
+    messages = await crud.get_channel_messages_async(db, channel_id=channel_id, limit=limit, before=before, after=after)
     # Reverse to show oldest first in chat? Or newest at bottom. 
     # Usually API returns newest first (desc), frontend reverses it.
     return messages
 
-@app.post("/channels/{channel_id}/messages", response_model=schemas.Message)
-async def create_message(channel_id: int, message: schemas.MessageCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # 1. Save to DB
-    db_message = crud.create_message(db, message, user_id=current_user.id, channel_id=channel_id)
+@app.post("/sync", response_model=schemas.SyncResponse)
+async def sync_messages(
+    request: schemas.SyncRequest,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    # Reconnect catch-up: one batched query for every channel the client lists
+    if len(request.channels) > crud.MAX_SYNC_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"At most {crud.MAX_SYNC_CHANNELS} channels per sync")
+    # Only channels of servers the user belongs to (routing index, no DB reads)
+    cursors = {
+        channel_id: last_seen for channel_id, last_seen in request.channels.items()
+        if current_user.id in routing.index.members_for_channel(channel_id)
+    }
+    messages, truncated = await crud.get_messages_since_async(db, cursors)
+    return {"messages": messages, "truncated": truncated}
+
+@app.get("/search", response_model=schemas.SearchResults)
+async def search_messages(
+    q: str = Query(..., max_length=200),
+    channel_id: Optional[int] = None,
+    server_id: Optional[int] = None,
+    sort: str = Query("relevance", pattern="^(relevance|recent)$"),
+    limit: int = Query(20, ge=1, le=search.MAX_SEARCH_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(database.get_async_read_db),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    # Scope is one channel or all channels of one server the user belongs to
+    if (channel_id is None) == (server_id is None):
+        raise HTTPException(status_code=400, detail="Exactly one of channel_id or server_id is required")
+    if len(q.strip()) < search.MIN_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Query must be at least {search.MIN_QUERY_LENGTH} characters")
+    if channel_id is not None:
+        server_id = routing.index.server_for_channel(channel_id)
+        channel_ids = [channel_id]
+    else:
+        channel_ids = list(routing.index.server_channels.get(server_id, ()))
+    if server_id is None or current_user.id not in routing.index.members_of(server_id):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        messages, next_cursor = await search.search_messages(
+            db, q.strip(), channel_ids, limit=limit, cursor=cursor, sort=sort
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"messages": messages, "next_cursor": next_cursor}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    # Prometheus text format; each worker reports its own counters
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/message-cache")
+def read_message_cache_stats():
+    # Hit/miss counters for sizing QUICKLINK_MESSAGE_CACHE_BYTES / _RING
+    return message_cache.cache.stats()
+
+async def post_message(channel_id: int, content: str, sender: schemas.User) -> schemas.Message:
+    """Persist a message and broadcast it; shared by the REST route and WebSocket sends.
+
+    Raises HTTPException (403) or ingest.IngestBusy before anything is saved; once the
+    message is committed it is returned even if the broadcast fails.
+    """
+    # 0. Only members may post (membership from the routing index, no DB read)
+    if sender.id not in routing.index.members_for_channel(channel_id):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    # 1. Save to DB through the group-commit stage (one transaction per burst)
+    persisted = await ingest.writer.submit(content, user_id=sender.id, channel_id=channel_id)
     
+    # Format message using Pydantic schema to ensure correct serialization (e.g. timezone)
+    # Sender comes from the auth snapshot to avoid an extra DB query
+    message_schema = schemas.Message(
+        id=persisted.id,
+        content=content,
+        timestamp=persisted.timestamp,
+        user_id=sender.id,
+        channel_id=channel_id,
+        sender=sender,
+    )
+
     # 2. Broadcast via WebSocket
-    # We need to find the server this channel belongs to, then find all members
-    channel = db.query(models.Channel).filter(models.Channel.id == channel_id).first()
-    if channel:
-        server = channel.server
-        member_ids = [m.id for m in server.members]
-        
-        # Format message for WS using Pydantic schema to ensure correct serialization (e.g. timezone)
-        # Assign sender manually to avoid extra DB query and ensure it's present
-        db_message.sender = current_user
-        message_schema = schemas.Message.model_validate(db_message)
-        
+    # Channel -> server -> members comes from the in-memory routing index, no DB reads
+    server_id = routing.index.server_for_channel(channel_id)
+    if server_id is not None:
         ws_data = {
             "type": "new_message",
-            "message": json.loads(message_schema.model_dump_json())
+            "message": message_schema.model_dump(mode="json")
         }
-        await manager.broadcast_to_server_members(ws_data, member_ids)
+        try:
+            await manager.broadcast_to_server(ws_data, server_id)
+        except Exception as e:
+            # Saved already: failing the send now would invite a duplicate retry
+            print(f"Broadcast of message {persisted.id} failed: {e!r}")
         
-    return db_message
+    return message_schema
+
+@app.post("/channels/{channel_id}/messages", response_model=schemas.Message)
+async def create_message(channel_id: int, message: schemas.MessageCreate, current_user: schemas.User = Depends(get_current_user)):
+    try:
+        return await post_message(channel_id, message.content, current_user)
+    except ingest.IngestBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many messages waiting to be saved, retry shortly",
+            headers={"Retry-After": "1"},
+        )
 
 # --- WebSocket ---
+WS_MAX_BATCH = 50  # send_message frames accepted in one WebSocket frame
+
+async def handle_send_message(conn: ClientConnection, sender: Optional[schemas.User], raw: dict):
+    """Persist one WS send and queue its ack (or error) on the sender's socket."""
+    nonce = raw.get("nonce") if isinstance(raw, dict) else None
+    try:
+        frame = schemas.WSSendMessage.model_validate(raw)
+    except ValidationError:
+        conn.send({"type": "error", "nonce": nonce, "detail": "Invalid send_message frame"})
+        return
+    if sender is None:
+        conn.send({"type": "error", "nonce": nonce, "detail": "Could not validate credentials"})
+        return
+    # `retryable`: nothing was saved and sending again may succeed
+    try:
+        message = await post_message(frame.channel_id, frame.content, sender)
+    except HTTPException as e:
+        conn.send({"type": "error", "nonce": nonce, "detail": e.detail})
+        return
+    except ingest.IngestBusy:
+        conn.send({"type": "error", "nonce": nonce, "detail": "Too many messages waiting to be saved", "retryable": True})
+        return
+    except Exception:
+        # post_message only raises before its commit completes
+        conn.send({"type": "error", "nonce": nonce, "detail": "Message could not be saved", "retryable": True})
+        return
+    conn.send({"type": "ack", "nonce": nonce, "message": message.model_dump(mode="json")})
+
+async def handle_presence_frame(conn: ClientConnection, sender: Optional[schemas.User], raw: dict):
+    """`view_channel` (which channel the client shows) and `typing` signals."""
+    try:
+        if raw["type"] == "view_channel":
+            frame = schemas.WSViewChannel.model_validate(raw)
+        else:
+            frame = schemas.WSTyping.model_validate(raw)
+    except ValidationError:
+        conn.send({"type": "error", "nonce": None, "detail": f"Invalid {raw['type']} frame"})
+        return
+    if frame.channel_id is not None and conn.user_id not in routing.index.members_for_channel(frame.channel_id):
+        conn.send({"type": "error", "nonce": None, "detail": "Not authorized"})
+        return
+    if frame.type == "view_channel":
+        snapshot = manager.presence.view(conn.user_id, frame.channel_id)
+        if snapshot:
+            conn.send(snapshot)
+    elif sender is None:
+        conn.send({"type": "error", "nonce": None, "detail": "Could not validate credentials"})
+    else:
+        await manager.presence.typing(sender.id, frame.channel_id)
+
+async def handle_frame(conn: ClientConnection, sender: Optional[schemas.User], raw):
+    if isinstance(raw, dict) and raw.get("type") in ("view_channel", "typing"):
+        await handle_presence_frame(conn, sender, raw)
+    else:
+        await handle_send_message(conn, sender, raw)
+
+async def resolve_ws_sender(token: Optional[str], user_id: int) -> Optional[schemas.User]:
+    """The socket's sender if ?token= authenticates `user_id`; None otherwise."""
+    if not token:
+        return None
+    # A session only connects on a token cache miss
+    async with database.AsyncReadSessionLocal() as db:
+        sender = await resolve_token(token, db)
+    return sender if sender is not None and sender.id == user_id else None
+
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(websocket, user_id)
+async def websocket_endpoint(websocket: WebSocket, user_id: int, token: Optional[str] = None):
+    # Receiving only needs the user id; sending and showing as online require ?token= for that same user
+    sender = await resolve_ws_sender(token, user_id)
+    conn = await manager.connect(websocket, user_id, authenticated=sender is not None)
     try:
         while True:
             data = await websocket.receive_text()
-            # We can handle direct WS messages here if needed
-            # For now, we use REST API for sending messages to persist them easily
-            # But we could allow sending via WS too.
-            pass
+            try:
+                frames = orjson.loads(data)
+            except ValueError:
+                conn.send({"type": "error", "nonce": None, "detail": "Invalid JSON"})
+                continue
+            # A frame is one send_message object or a list of them (batched sends)
+            if not isinstance(frames, list):
+                frames = [frames]
+            if len(frames) > WS_MAX_BATCH:
+                conn.send({"type": "error", "nonce": None, "detail": f"At most {WS_MAX_BATCH} messages per frame"})
+                continue
+            # Checked per frame: the token may have expired, or the user been renamed, since connecting
+            sender = await resolve_ws_sender(token, user_id)
+            # Sends in one frame go through ingest together and share a commit
+            await asyncio.gather(*(handle_frame(conn, sender, raw) for raw in frames))
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        pass
+    finally:
+        # Any other error too: never leave a dead connection (and its presence session) registered
+        manager.disconnect(user_id, conn)
@@ -0,0 +1,195 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Recent messages kept per channel; covers the largest latest-page request
+RING_SIZE = int(os.environ.get("QUICKLINK_MESSAGE_CACHE_RING", "100"))
+# Total budget across channels, least recently read channels are evicted first
+MEMORY_BUDGET_BYTES = int(os.environ.get("QUICKLINK_MESSAGE_CACHE_BYTES", str(64 * 1024 * 1024)))
+# A ring is reloaded from the DB after this long, in case it missed a broadcast (0: never)
+MAX_AGE_SECONDS = float(os.environ.get("QUICKLINK_MESSAGE_CACHE_MAX_AGE_SECONDS", "60"))
+# Rough per-message cost on top of the content (dict, sender, timestamp)
+ENTRY_OVERHEAD_BYTES = 400
+
+
+def _entry_size(message: dict) -> int:
+    return ENTRY_OVERHEAD_BYTES + len(message.get("content", ""))
+
+
+class ChannelRing:
+    """Latest messages of one channel, newest first, as JSON-ready dicts."""
+
+    def __init__(self, messages: List[dict]):
+        self.messages: List[dict] = messages[:RING_SIZE]
+        self.size = sum(_entry_size(m) for m in self.messages)
+        # When the DB last confirmed this ring's contents
+        self.loaded_at = time.monotonic()
+
+    def add(self, message: dict) -> int:
+        """Insert by id (broadcasts can arrive slightly out of order); returns the size delta."""
+        before = self.size
+        ids = [m["id"] for m in self.messages]
+        if message["id"] in ids:
+            return 0
+        pos = 0
+        while pos < len(ids) and ids[pos] > message["id"]:
+            pos += 1
+        if pos >= RING_SIZE:
+            return 0
+        self.messages.insert(pos, message)
+        self.size += _entry_size(message)
+        while len(self.messages) > RING_SIZE:
+            self.size -= _entry_size(self.messages.pop())
+        return self.size - before
+
+
+class MessageCache:
+    """LRU of per-channel rings within a memory budget.
+
+    A channel is only cached once its latest page was loaded from the DB, so a cached
+    ring always holds the true newest messages. New messages are added from the
+    broadcast event, which every worker receives; rings older than MAX_AGE_SECONDS
+    are reloaded, so one that missed a broadcast is only wrong for a bounded time.
+    """
+
+    def __init__(self, budget: int = MEMORY_BUDGET_BYTES):
+        self.budget = budget
+        self.rings: "OrderedDict[int, ChannelRing]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # channel_id -> fill token -> messages that arrived while that page was being loaded
+        self._loading: Dict[int, Dict[object, List[dict]]] = {}
+        self._lock = threading.Lock()
+        # Called with every invalidation so other workers can replay it
+        self.on_change: Optional[Callable[[dict], None]] = None
+
+    def get_latest(self, channel_id: int, limit: int) -> Optional[List[dict]]:
+        with self._lock:
+            ring = self.rings.get(channel_id)
+            if ring is not None and MAX_AGE_SECONDS and time.monotonic() - ring.loaded_at > MAX_AGE_SECONDS:
+                del self.rings[channel_id]
+                self.size -= ring.size
+                self.expirations += 1
+                ring = None
+            if ring is None or limit > RING_SIZE:
+                self.misses += 1
+                return None
+            self.rings.move_to_end(channel_id)
+            self.hits += 1
+            return ring.messages[:limit]
+
+    def begin_fill(self, channel_id: int) -> object:
+        """Call before reading the latest page from the DB for a miss; returns the fill token."""
+        token = object()
+        with self._lock:
+            self._loading.setdefault(channel_id, {})[token] = []
+        return token
+
+    def _pop_fill(self, channel_id: int, token: object) -> Optional[List[dict]]:
+        fills = self._loading.get(channel_id)
+        if fills is None or token not in fills:
+            return None
+        raced = fills.pop(token)
+        if not fills:
+            del self._loading[channel_id]
+        return raced
+
+    def finish_fill(self, channel_id: int, token: object, messages: List[dict]):
+        """Install the page read from the DB (newest first), plus anything that raced it.
+
+        Concurrent fills of one channel merge into the same ring instead of replacing it,
+        so an older page finishing last cannot drop newer messages. A fill abandoned by
+        clear()/discard() installs nothing.
+        """
+        with self._lock:
+            raced = self._pop_fill(channel_id, token)
+            if raced is None:
+                return
+            ring = self.rings.get(channel_id)
+            if ring is None:
+                ring = self.rings[channel_id] = ChannelRing(messages)
+                self.size += ring.size
+            else:
+                for message in messages:
+                    self.size += ring.add(message)
+                ring.loaded_at = time.monotonic()
+                self.rings.move_to_end(channel_id)
+            for message in raced:
+                self.size += ring.add(message)
+            self._evict()
+
+    def abandon_fill(self, channel_id: int, token: object):
+        """Stop collecting for a fill that failed or was cancelled (no-op once finished)."""
+        with self._lock:
+            self._pop_fill(channel_id, token)
+
+    def add(self, message: dict):
+        channel_id = message["channel_id"]
+        with self._lock:
+            for raced in self._loading.get(channel_id, {}).values():
+                raced.append(message)
+            ring = self.rings.get(channel_id)
+            if ring is not None:
+                self.size += ring.add(message)
+                self._evict()
+
+    def discard(self, channel_id: int):
+        with self._lock:
+            self._loading.pop(channel_id, None)
+            ring = self.rings.pop(channel_id, None)
+            if ring:
+                self.size -= ring.size
+
+    def clear(self):
+        with self._lock:
+            # In-flight fills may hold stale data: they are abandoned too
+            self._loading.clear()
+            self.rings.clear()
+            self.size = 0
+
+    # --- Invalidations (applied locally and replayed by the other workers) ---
+
+    def invalidate(self):
+        self.apply({"op": "clear"})
+
+    def discard_channels(self, channel_ids: Iterable[int]):
+        self.apply({"op": "discard", "channel_ids": list(channel_ids)})
+
+    def apply(self, change: dict, notify: bool = True):
+        op = change["op"]
+        if op == "clear":
+            self.clear()
+        elif op == "discard":
+            for channel_id in change["channel_ids"]:
+                self.discard(channel_id)
+        else:
+            raise ValueError(f"Unknown message cache change: {op}")
+        if notify and self.on_change:
+            self.on_change(change)
+
+    def _evict(self):
+        while self.size > self.budget and len(self.rings) > 1:
+            _, ring = self.rings.popitem(last=False)
+            self.size -= ring.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "channels": len(self.rings),
+                "bytes": self.size,
+                "budget_bytes": self.budget,
+                "ring_size": RING_SIZE,
+            }
+
+
+cache = MessageCache()
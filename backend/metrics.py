@@ -0,0 +1,194 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Each worker keeps its own values; /metrics reports the worker that serves the scrape.
+"""
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+# Fraction of HTTP requests whose latency and DB cost are recorded (counters are always exact)
+SAMPLE_RATE = float(os.environ.get("QUICKLINK_METRICS_SAMPLE_RATE", "1.0"))
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def _samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(Metric):
+    """Gauge read from a callback at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def _samples(self):
+        yield f"{self.name} {self.callback()}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [bucket counts..., sum, count]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def _samples(self):
+        for key, data in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                le = 'le="%s"' % bound
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {data[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}"
+
+
+registry = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+# --- Metrics ---
+
+http_requests = Counter("quicklink_http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_latency = Histogram("quicklink_http_request_seconds", "HTTP request latency (sampled)", ("method", "route"))
+db_queries = Counter("quicklink_db_queries_total", "SQL statements executed")
+db_query_seconds = Counter("quicklink_db_query_seconds_total", "Time spent executing SQL statements")
+request_db_queries = Histogram(
+    "quicklink_http_request_db_queries", "SQL statements per HTTP request (sampled)", ("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+request_db_seconds = Histogram("quicklink_http_request_db_seconds", "SQL time per HTTP request (sampled)", ("route",))
+broadcast_seconds = Histogram("quicklink_broadcast_fanout_seconds", "Time to queue one broadcast to local sockets")
+broadcast_recipients = Counter("quicklink_broadcast_recipients_total", "Frames queued by broadcasts")
+ws_send_failures = Counter("quicklink_ws_send_failures_total", "WebSocket sends that failed or overflowed", ("reason",))
+message_commit_seconds = Histogram("quicklink_message_commit_seconds", "Message insert + commit latency (one batch)")
+message_commit_batch = Histogram(
+    "quicklink_message_commit_batch_size", "Messages per committed batch",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+
+
+# --- Per-request DB accounting ---
+
+# Set by the middleware for sampled requests: {"queries": n, "seconds": t}
+_request_db: ContextVar[Optional[dict]] = ContextVar("quicklink_request_db", default=None)
+
+
+def instrument_engine(sync_engine):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.inc()
+        db_query_seconds.inc(elapsed)
+        stats = _request_db.get()
+        if stats is not None:
+            stats["queries"] += 1
+            stats["seconds"] += elapsed
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request counts always, latency and DB cost for a sample of requests."""
+
+    def __init__(self, app, sample_rate: float = SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        stats = {"queries": 0, "seconds": 0.0} if sampled else None
+        token = _request_db.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db.reset(token)
+            # Route template (e.g. /channels/{channel_id}/messages), not the raw path
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_requests.inc(method=method, route=route, status=status_code[0])
+            if sampled:
+                http_latency.observe(elapsed, method=method, route=route)
+                request_db_queries.observe(stats["queries"], route=route)
+                request_db_seconds.observe(stats["seconds"], route=route)
@@ -0,0 +1,189 @@
+"""Versioned schema migrations.
+
+Run once per deploy, before (re)starting the workers:
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # print current / latest version
+
+Applied versions are recorded in `schema_version`, so a current database is
+one query. Workers only check the version at startup and refuse to start on an
+outdated schema instead of migrating concurrently. Every step is idempotent, so
+databases created before this table existed are brought up to date from 1.
+"""
+import os
+import sys
+
+from sqlalchemy import text
+
+import models, search
+
+# Rows per transaction for data backfills, so writers are never locked out for long
+BATCH_SIZE = int(os.environ.get("QUICKLINK_MIGRATION_BATCH_SIZE", "5000"))
+
+SCHEMA_VERSION_DDL = """CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)"""
+
+# Random version-4 UUID text, same format as crud.create_server
+SQL_UUID4 = (
+    "lower(hex(randomblob(4))) || '-' || lower(hex(randomblob(2))) || '-4' || "
+    "substr(lower(hex(randomblob(2))), 2) || '-' || substr('89ab', 1 + abs(random()) % 4, 1) || "
+    "substr(lower(hex(randomblob(2))), 2) || '-' || lower(hex(randomblob(6)))"
+)
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+def _columns(conn, table: str):
+    return [row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def _has_index(conn, name: str) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {"name": name}
+    ).first() is not None
+
+
+def _in_batches(conn, statement: str, params: dict = None) -> int:
+    """Repeat a set-based statement bounded by LIMIT :batch until it touches no rows."""
+    total = 0
+    while True:
+        count = conn.execute(text(statement), dict(params or {}, batch=BATCH_SIZE)).rowcount
+        conn.commit()
+        total += count
+        if count == 0:
+            return total
+
+
+# --- Migrations ---
+
+def create_base_schema(conn):
+    models.Base.metadata.create_all(bind=conn)
+
+
+def add_server_invite_codes(conn):
+    if "invite_code" not in _columns(conn, "servers"):
+        conn.execute(text("ALTER TABLE servers ADD COLUMN invite_code VARCHAR"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_servers_invite_code ON servers (invite_code)"))
+    conn.commit()
+    filled = _in_batches(conn, f"""
+        UPDATE servers SET invite_code = {SQL_UUID4}
+        WHERE id IN (SELECT id FROM servers WHERE invite_code IS NULL LIMIT :batch)
+    """)
+    if filled:
+        print(f"  generated {filled} invite codes")
+
+
+def add_membership_keys(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_server_members_user_server ON server_members (user_id, server_id)"))
+    conn.commit()
+    if not _has_index(conn, "ux_server_members_server_user"):
+        # Older versions could insert the same membership twice; keep the first row
+        removed = _in_batches(conn, """
+            DELETE FROM server_members WHERE rowid IN (
+                SELECT s.rowid FROM server_members s
+                WHERE EXISTS (
+                    SELECT 1 FROM server_members d
+                    WHERE d.user_id = s.user_id AND d.server_id = s.server_id AND d.rowid < s.rowid
+                )
+                LIMIT :batch
+            )
+        """)
+        if removed:
+            print(f"  removed {removed} duplicate memberships")
+        conn.execute(text("CREATE UNIQUE INDEX ux_server_members_server_user ON server_members (server_id, user_id)"))
+
+
+def add_message_history_index(conn):
+    # Composite index backing keyset pagination of channel history
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_channel_timestamp_id ON messages (channel_id, timestamp, id)"))
+
+
+def add_search_index(conn):
+    search.ensure_search_index(conn)
+    # Start from empty so an interrupted run can simply be repeated
+    conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('delete-all')"))
+    conn.commit()
+    last_id = 0
+    indexed = 0
+    while True:
+        ids = conn.execute(text(
+            "SELECT id FROM messages WHERE id > :last ORDER BY id LIMIT :batch"
+        ), {"last": last_id, "batch": BATCH_SIZE}).scalars().all()
+        if not ids:
+            break
+        conn.execute(text(
+            "INSERT INTO messages_fts(rowid, content) "
+            "SELECT id, content FROM messages WHERE id BETWEEN :first AND :last"
+        ), {"first": ids[0], "last": ids[-1]})
+        conn.commit()
+        last_id = ids[-1]
+        indexed += len(ids)
+    if indexed:
+        print(f"  indexed {indexed} messages")
+
+
+# (version, function); append only, never renumber
+MIGRATIONS = [
+    (1, create_base_schema),
+    (2, add_server_invite_codes),
+    (3, add_membership_keys),
+    (4, add_message_history_index),
+    (5, add_search_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )).first()
+    if not exists:
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def migrate(engine) -> int:
+    """Apply pending migrations in order; returns the number applied."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+        pending = [(v, fn) for v, fn in MIGRATIONS if v > version]
+        if not pending:
+            return 0
+        conn.execute(text(SCHEMA_VERSION_DDL))
+        conn.commit()
+        for v, fn in pending:
+            print(f"Applying migration {v}: {fn.__name__}...")
+            fn(conn)
+            conn.execute(text("INSERT INTO schema_version (version, name) VALUES (:v, :name)"),
+                         {"v": v, "name": fn.__name__})
+            conn.commit()
+        return len(pending)
+
+
+def check_current(engine):
+    """Raise SchemaOutdated unless every migration has been applied."""
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version < LATEST_VERSION:
+        raise SchemaOutdated(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run `python migrate.py` first"
+        )
+
+
+if __name__ == "__main__":
+    import database
+
+    if sys.argv[1:] == ["--status"]:
+        with database.engine.connect() as conn:
+            print(f"Schema version {current_version(conn)} (latest {LATEST_VERSION})")
+        sys.exit(0)
+    if sys.argv[1:]:
+        print("Usage: python migrate.py [--status]")
+        sys.exit(1)
+    applied = migrate(database.engine)
+    print(f"Applied {applied} migration(s)." if applied else "Database is up to date.")
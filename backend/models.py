@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Table, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -9,6 +9,10 @@ server_members = Table(
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id")),
     Column("server_id", Integer, ForeignKey("servers.id")),
+    # One row per (server, user); serves membership checks and member paging
+    Index("ux_server_members_server_user", "server_id", "user_id", unique=True),
+    # Reverse direction: servers of a user
+    Index("ix_server_members_user_server", "user_id", "server_id"),
 )
 
 class User(Base):
@@ -55,3 +59,8 @@ class Message(Base):
 
     sender = relationship("User", back_populates="messages")
     channel = relationship("Channel", back_populates="messages")
+
+    # Covers history paging: WHERE channel_id = ? ORDER BY timestamp, id
+    __table_args__ = (
+        Index("ix_messages_channel_timestamp_id", "channel_id", "timestamp", "id"),
+    )
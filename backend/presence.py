@@ -0,0 +1,248 @@
+"""Online presence and typing indicators with coalesced, rate-limited fan-out.
+
+The worker holding a user's socket debounces that user's signals and publishes
+small events on the broker (user online / offline on this worker, or "typing in
+channel X"). Every worker folds the events it receives into per-tick state and,
+once per tick, sends each local client at most one `presence` frame: online /
+offline changes among the members of the server it is viewing plus who is typing
+in the channel it is viewing. Clients that have not said which channel they are
+viewing get nothing, and a server costs at most one frame per viewer per tick
+however many members are typing.
+
+Each worker also publishes a snapshot of its online users every SNAPSHOT_SECONDS
+and an empty one when it stops. Other workers replace what they know about it
+with the snapshot and forget a worker they have not heard from in
+WORKER_TIMEOUT_SECONDS, so a lost event or a crashed worker can only make
+presence wrong for a bounded time, and a newly started worker learns everyone
+who is online within one snapshot period.
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import orjson
+
+import routing
+
+TICK_SECONDS = int(os.environ.get("QUICKLINK_PRESENCE_TICK_MS", "500")) / 1000
+# At most one typing event per user per channel in this window; clients send on keystrokes
+TYPING_DEBOUNCE_SECONDS = float(os.environ.get("QUICKLINK_TYPING_DEBOUNCE_SECONDS", "2"))
+# Clients show a typist for this long after the last frame naming them
+TYPING_TTL_SECONDS = 6
+# A disconnect only turns into "offline" if the user has not come back within this window
+OFFLINE_GRACE_SECONDS = float(os.environ.get("QUICKLINK_PRESENCE_OFFLINE_GRACE_SECONDS", "5"))
+# Typists listed per frame; `typing_count` carries the total
+MAX_TYPING_SHOWN = 5
+# Every worker republishes its online users this often
+SNAPSHOT_SECONDS = float(os.environ.get("QUICKLINK_PRESENCE_SNAPSHOT_SECONDS", "30"))
+# A worker missing this long (several snapshots) is assumed dead and its users offline
+WORKER_TIMEOUT_SECONDS = 3 * SNAPSHOT_SECONDS
+
+
+def _split_changes(changed: Dict[int, bool], members) -> Tuple[list, list]:
+    """(came online, went offline) among `members`, walking the smaller side."""
+    if len(changed) <= len(members):
+        relevant = [(uid, online) for uid, online in changed.items() if uid in members]
+    else:
+        relevant = [(uid, changed[uid]) for uid in members if uid in changed]
+    return [uid for uid, online in relevant if online], [uid for uid, online in relevant if not online]
+
+
+class PresenceHub:
+    """Per-worker presence state, debouncing and the tick that flushes it."""
+
+    def __init__(self, publish: Callable[[dict], Awaitable[None]], connections: Dict[int, object]):
+        self.publish = publish
+        # user_id -> ClientConnection, shared with the ConnectionManager
+        self.connections = connections
+        self.worker_id = uuid.uuid4().hex
+        # Users this worker has announced as online
+        self.local: Set[int] = set()
+        # From events: worker id -> its online users, when it was last heard from,
+        # and user_id -> number of workers listing the user
+        self.worker_users: Dict[str, Set[int]] = {}
+        self.worker_seen: Dict[str, float] = {}
+        self.sessions: Dict[int, int] = {}
+        # Local viewers: user_id -> channel_id and channel_id -> user ids
+        self.viewing: Dict[int, int] = {}
+        self.viewers: Dict[int, Set[int]] = {}
+        self._last_typing: Dict[int, Tuple[int, float]] = {}
+        self._offline_timers: Dict[int, asyncio.TimerHandle] = {}
+        # Pending for the next tick: user_id -> now online?, channel_id -> typists (ordered)
+        self._changed: Dict[int, bool] = {}
+        self._typing: Dict[int, Dict[int, None]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_snapshot = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._tick_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for timer in self._offline_timers.values():
+            timer.cancel()
+        self._offline_timers.clear()
+        # Everyone connected here goes offline with this worker
+        self.local.clear()
+        await self.publish({"kind": "presence_snapshot", "worker": self.worker_id, "users": [], "final": True})
+
+    # --- Local signals (this worker holds the user's socket) ---
+
+    async def connected(self, user_id: int):
+        timer = self._offline_timers.pop(user_id, None)
+        if timer:
+            # Reconnected within the grace period: never went offline
+            timer.cancel()
+            return
+        self.local.add(user_id)
+        await self.publish({"kind": "presence", "worker": self.worker_id, "user_id": user_id, "online": True})
+
+    def disconnected(self, user_id: int):
+        self.view(user_id, None)
+        self._last_typing.pop(user_id, None)
+        if user_id in self._offline_timers:
+            return
+        loop = asyncio.get_running_loop()
+        self._offline_timers[user_id] = loop.call_later(OFFLINE_GRACE_SECONDS, self._went_offline, user_id)
+
+    def _went_offline(self, user_id: int):
+        self._offline_timers.pop(user_id, None)
+        self.local.discard(user_id)
+        asyncio.ensure_future(self.publish({"kind": "presence", "worker": self.worker_id, "user_id": user_id, "online": False}))
+
+    async def typing(self, user_id: int, channel_id: int):
+        now = time.monotonic()
+        last = self._last_typing.get(user_id)
+        if last and last[0] == channel_id and now - last[1] < TYPING_DEBOUNCE_SECONDS:
+            return
+        self._last_typing[user_id] = (channel_id, now)
+        await self.publish({"kind": "typing", "user_id": user_id, "channel_id": channel_id})
+
+    def view(self, user_id: int, channel_id: Optional[int]) -> Optional[dict]:
+        """Record which channel a local client shows; returns the presence snapshot for its server."""
+        previous = self.viewing.pop(user_id, None)
+        if previous is not None:
+            viewers = self.viewers.get(previous)
+            if viewers is not None:
+                viewers.discard(user_id)
+                if not viewers:
+                    del self.viewers[previous]
+        server_id = routing.index.server_for_channel(channel_id) if channel_id is not None else None
+        if server_id is None:
+            return None
+        self.viewing[user_id] = channel_id
+        self.viewers.setdefault(channel_id, set()).add(user_id)
+        members = routing.index.members_of(server_id)
+        if len(self.sessions) < len(members):
+            online = [uid for uid in self.sessions if uid in members]
+        else:
+            online = [uid for uid in members if uid in self.sessions]
+        return {"type": "presence_state", "server_id": server_id, "channel_id": channel_id, "online": online}
+
+    # --- Events from the broker (every worker) ---
+
+    def apply(self, event: dict):
+        if event["kind"] == "typing":
+            if event["channel_id"] in self.viewers:
+                self._typing.setdefault(event["channel_id"], {})[event["user_id"]] = None
+            return
+        worker = event["worker"]
+        if event["kind"] == "presence":
+            self._mark(worker, event["user_id"], event["online"])
+        else:
+            # presence_snapshot: the worker's full list replaces what we had for it
+            users = set(event["users"])
+            known = self.worker_users.get(worker, set())
+            for user_id in known - users:
+                self._mark(worker, user_id, False)
+            for user_id in users - known:
+                self._mark(worker, user_id, True)
+            if event.get("final"):
+                self.worker_users.pop(worker, None)
+                self.worker_seen.pop(worker, None)
+                return
+        self.worker_seen[worker] = time.monotonic()
+
+    def _mark(self, worker: str, user_id: int, online: bool):
+        users = self.worker_users.setdefault(worker, set())
+        if online == (user_id in users):
+            return
+        before = self.sessions.get(user_id, 0)
+        if online:
+            users.add(user_id)
+            after = before + 1
+        else:
+            users.discard(user_id)
+            after = before - 1
+        if after:
+            self.sessions[user_id] = after
+        else:
+            self.sessions.pop(user_id, None)
+        if (before > 0) != (after > 0):
+            # Changes within one tick cancel out, so a quick flap is never sent
+            if self._changed.get(user_id) == (not online):
+                del self._changed[user_id]
+            else:
+                self._changed[user_id] = online
+
+    def _expire_workers(self, now: float):
+        for worker, seen in list(self.worker_seen.items()):
+            if worker != self.worker_id and now - seen > WORKER_TIMEOUT_SECONDS:
+                # Died without its final snapshot
+                self.apply({"kind": "presence_snapshot", "worker": worker, "users": [], "final": True})
+
+    # --- Fan-out ---
+
+    async def _tick_loop(self):
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            try:
+                now = time.monotonic()
+                if now - self._last_snapshot >= SNAPSHOT_SECONDS:
+                    self._last_snapshot = now
+                    self._expire_workers(now)
+                    await self.publish({"kind": "presence_snapshot", "worker": self.worker_id, "users": list(self.local)})
+                self.flush()
+            except Exception as e:
+                print(f"Presence flush failed: {e}")
+
+    def flush(self):
+        changed, self._changed = self._changed, {}
+        typing, self._typing = self._typing, {}
+        if not changed and not typing:
+            return
+        # Presence diff per server, computed once for all of its viewed channels
+        diffs: Dict[int, Tuple[list, list]] = {}
+        for channel_id, viewers in list(self.viewers.items()):
+            server_id = routing.index.server_for_channel(channel_id)
+            if server_id is None:
+                continue
+            if server_id not in diffs:
+                diffs[server_id] = _split_changes(changed, routing.index.members_of(server_id))
+            online, offline = diffs[server_id]
+            typists = list(typing.get(channel_id, ()))
+            if not (online or offline or typists):
+                continue
+            # One encoding per viewed channel; every viewer of it gets the same frame
+            frame = orjson.dumps({
+                "type": "presence",
+                "server_id": server_id,
+                "channel_id": channel_id,
+                "online": online,
+                "offline": offline,
+                "typing": typists[:MAX_TYPING_SHOWN],
+                "typing_count": len(typists),
+                "typing_ttl": TYPING_TTL_SECONDS,
+            }).decode()
+            for user_id in list(viewers):
+                conn = self.connections.get(user_id)
+                if conn is not None:
+                    # Best effort: a client too slow for this frame is dropped by the message path anyway
+                    conn.send_frame(frame)
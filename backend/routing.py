@@ -0,0 +1,97 @@
+import os
+import threading
+from typing import Callable, Dict, FrozenSet, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+
+EMPTY: FrozenSet[int] = frozenset()
+
+# Multi-worker buses reload the index this often, in case a change event never arrived (0 disables)
+REBUILD_SECONDS = float(os.environ.get("QUICKLINK_ROUTING_REBUILD_SECONDS", "300"))
+
+
+class RoutingIndex:
+    """In-memory channel -> server -> member ids map used by the broadcast path.
+
+    Member sets are replaced (copy-on-write) rather than mutated, so the event loop
+    can iterate a snapshot while sync routes update the index from the threadpool.
+    """
+
+    def __init__(self):
+        self.channel_server: Dict[int, int] = {}
+        self.server_channels: Dict[int, FrozenSet[int]] = {}
+        self.server_members: Dict[int, FrozenSet[int]] = {}
+        self._lock = threading.Lock()
+        # Bumped by every applied change, so a rebuild can tell it raced one
+        self.version = 0
+        # Called with every change so other workers can replay it
+        self.on_change: Optional[Callable[[dict], None]] = None
+
+    def rebuild(self, db: Session) -> bool:
+        """Load the whole index with two column-only queries (no ORM objects).
+
+        Returns False, keeping the current index, if a change was applied while loading.
+        """
+        version = self.version
+        channel_server: Dict[int, int] = {}
+        server_channels: Dict[int, set] = {}
+        server_members: Dict[int, set] = {}
+        for channel_id, server_id in db.execute(select(models.Channel.id, models.Channel.server_id)):
+            channel_server[channel_id] = server_id
+            server_channels.setdefault(server_id, set()).add(channel_id)
+        members = models.server_members.c
+        for server_id, user_id in db.execute(select(members.server_id, members.user_id)):
+            server_members.setdefault(server_id, set()).add(user_id)
+        with self._lock:
+            if self.version != version:
+                return False
+            self.channel_server = channel_server
+            self.server_channels = {k: frozenset(v) for k, v in server_channels.items()}
+            self.server_members = {k: frozenset(v) for k, v in server_members.items()}
+        return True
+
+    def server_for_channel(self, channel_id: int) -> Optional[int]:
+        return self.channel_server.get(channel_id)
+
+    def members_of(self, server_id: int) -> FrozenSet[int]:
+        return self.server_members.get(server_id, EMPTY)
+
+    def members_for_channel(self, channel_id: int) -> FrozenSet[int]:
+        server_id = self.channel_server.get(channel_id)
+        return self.members_of(server_id) if server_id is not None else EMPTY
+
+    # --- Mutations (called by crud after a successful commit) ---
+
+    def add_channel(self, channel_id: int, server_id: int):
+        self.apply({"op": "add_channel", "channel_id": channel_id, "server_id": server_id})
+
+    def add_member(self, server_id: int, user_id: int):
+        self.apply({"op": "add_member", "server_id": server_id, "user_id": user_id})
+
+    def remove_server(self, server_id: int):
+        self.apply({"op": "remove_server", "server_id": server_id})
+
+    def apply(self, change: dict, notify: bool = True):
+        op = change["op"]
+        server_id = change["server_id"]
+        with self._lock:
+            if op == "add_channel":
+                self.channel_server[change["channel_id"]] = server_id
+                self.server_channels[server_id] = self.server_channels.get(server_id, EMPTY) | {change["channel_id"]}
+            elif op == "add_member":
+                self.server_members[server_id] = self.server_members.get(server_id, EMPTY) | {change["user_id"]}
+            elif op == "remove_server":
+                for channel_id in self.server_channels.pop(server_id, EMPTY):
+                    self.channel_server.pop(channel_id, None)
+                self.server_members.pop(server_id, None)
+            else:
+                raise ValueError(f"Unknown routing change: {op}")
+            self.version += 1
+        if notify and self.on_change:
+            self.on_change(change)
+
+
+index = RoutingIndex()
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, field_validator
-from typing import List, Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Dict, List, Optional, Literal
 from datetime import datetime, timezone
 
 # User Schemas
@@ -19,11 +19,14 @@ class User(UserBase):
         from_attributes = True
 
 # Message Schemas
+# Characters per message; keeps every broadcast event small (see broker.MAX_EVENT_SIZE)
+MAX_MESSAGE_LENGTH = 4000
+
 class MessageBase(BaseModel):
     content: str
 
 class MessageCreate(MessageBase):
-    pass
+    content: str = Field(max_length=MAX_MESSAGE_LENGTH)
 
 class Message(MessageBase):
     id: int
@@ -42,6 +45,35 @@ class Message(MessageBase):
     class Config:
         from_attributes = True
 
+# WebSocket frames (client -> server)
+class WSSendMessage(BaseModel):
+    type: Literal["send_message"]
+    nonce: str  # client-chosen, echoed back in the ack
+    channel_id: int
+    content: str = Field(max_length=MAX_MESSAGE_LENGTH)
+
+class WSTyping(BaseModel):
+    type: Literal["typing"]
+    channel_id: int
+
+class WSViewChannel(BaseModel):
+    type: Literal["view_channel"]
+    channel_id: Optional[int] = None  # None: no channel open
+
+# Reconnect sync
+class SyncRequest(BaseModel):
+    # channel_id -> last message id the client has seen (0 if none)
+    channels: Dict[int, int]
+
+class SyncResponse(BaseModel):
+    messages: List[Message]  # oldest first within each channel
+    truncated: List[int] = []  # channels with more missed messages than returned; page on with `after`
+
+# Search
+class SearchResults(BaseModel):
+    messages: List[Message]
+    next_cursor: Optional[str] = None  # pass back as `cursor` for the next page
+
 # Channel Schemas
 class ChannelBase(BaseModel):
     name: str
@@ -72,6 +104,14 @@ class Server(ServerBase):
     class Config:
         from_attributes = True
 
+class ServerSummary(ServerBase):
+    """Listing view of a server: no channels, no invite code."""
+    id: int
+    owner_id: int
+
+    class Config:
+        from_attributes = True
+
 class ServerWithMembers(Server):
     members: List[User] = []
 
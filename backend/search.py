@@ -0,0 +1,138 @@
+"""Full-text message search on an SQLite FTS5 index.
+
+`messages_fts` is an external-content FTS5 table over `messages`, kept in sync
+incrementally by triggers, so every write path (ingest batches, ORM deletes)
+updates it. Rows written before the index existed are indexed by the migration
+that creates it (see migrate.py); the whole index can be rebuilt with:
+
+    python search.py backfill
+"""
+import os
+import sys
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text, select, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+import models
+
+# trigram matches substrings in any script (incl. CJK); unicode61 is word-based and smaller
+FTS_TOKENIZER = os.environ.get("QUICKLINK_FTS_TOKENIZER", "trigram")
+MIN_QUERY_LENGTH = 3 if FTS_TOKENIZER.startswith("trigram") else 1
+MAX_SEARCH_PAGE_SIZE = 50
+
+SEARCH_INDEX_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, content='messages', content_rowid='id', tokenize='{FTS_TOKENIZER}'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+
+def ensure_search_index(conn) -> bool:
+    """Create the FTS table and triggers if missing; True if the table is new (needs backfill)."""
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    )).first()
+    for ddl in SEARCH_INDEX_DDL:
+        conn.execute(text(ddl))
+    return exists is None
+
+
+def backfill(engine):
+    """(Re)index every existing message from the content table."""
+    with engine.begin() as conn:
+        ensure_search_index(conn)
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')"))
+
+
+def _match_expression(query: str) -> str:
+    # Search the text as a phrase so user input never hits FTS5 query syntax
+    return '"' + query.replace('"', '""') + '"'
+
+
+def _parse_cursor(cursor: Optional[str], sort: str):
+    if not cursor:
+        return None
+    try:
+        if sort == "recent":
+            return int(cursor)
+        rank, message_id = cursor.split(":")
+        return float(rank), int(message_id)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+async def search_messages(
+    db: AsyncSession,
+    query: str,
+    channel_ids: List[int],
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    sort: str = "relevance",
+) -> Tuple[list, Optional[str]]:
+    """Matching messages in `channel_ids` plus the cursor of the next page (None at the end).
+
+    sort="relevance" orders by bm25 rank (cursor "rank:id"), sort="recent" by id
+    descending (cursor "id"). Both are keyset cursors.
+    """
+    if not channel_ids:
+        return [], None
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    after = _parse_cursor(cursor, sort)
+    params = {"q": _match_expression(query), "channel_ids": channel_ids, "n": limit + 1}
+
+    where = "messages_fts MATCH :q AND m.channel_id IN :channel_ids"
+    if sort == "recent":
+        order = "m.id DESC"
+        if after is not None:
+            where += " AND m.id < :after_id"
+            params["after_id"] = after
+    else:
+        order = "messages_fts.rank, m.id"
+        if after is not None:
+            where += " AND (messages_fts.rank > :after_rank OR (messages_fts.rank = :after_rank AND m.id > :after_id))"
+            params["after_rank"], params["after_id"] = after
+
+    stmt = text(
+        f"SELECT m.id, messages_fts.rank FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        f"WHERE {where} ORDER BY {order} LIMIT :n"
+    ).bindparams(bindparam("channel_ids", expanding=True))
+    hits = (await db.execute(stmt, params)).all()
+
+    next_cursor = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        last_id, last_rank = hits[-1]
+        next_cursor = str(last_id) if sort == "recent" else f"{last_rank!r}:{last_id}"
+    if not hits:
+        return [], None
+
+    ids = [message_id for message_id, _ in hits]
+    rows = (await db.execute(
+        select(models.Message).options(selectinload(models.Message.sender)).where(models.Message.id.in_(ids))
+    )).scalars().all()
+    by_id = {m.id: m for m in rows}
+    return [by_id[i] for i in ids if i in by_id], next_cursor
+
+
+if __name__ == "__main__":
+    import database
+
+    if sys.argv[1:] != ["backfill"]:
+        print("Usage: python search.py backfill")
+        sys.exit(1)
+    print("Rebuilding messages_fts from messages...")
+    backfill(database.engine)
+    print("Done.")
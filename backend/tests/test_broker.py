@@ -0,0 +1,66 @@
+"""The Unix socket bus delivers every event in order, or tells the receiver it may not have."""
+import asyncio
+import tempfile
+
+import broker
+
+
+async def _pair(socket_dir):
+    received = ([], [])
+    a, b = broker.UnixSocketBroker(socket_dir), broker.UnixSocketBroker(socket_dir)
+    # Both run in this process, so give them distinct socket names
+    b.path = b.path.replace(".sock", "-b.sock")
+    await a.start(received[0].append)
+    await b.start(received[1].append)
+    return (a, b), received
+
+
+async def _until(condition, timeout=5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition() and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+
+
+def test_burst_reaches_peer_in_order():
+    async def run():
+        (a, b), (_, got) = await _pair(tempfile.mkdtemp())
+        for i in range(2000):
+            await a.publish({"kind": "broadcast", "n": i})
+        await _until(lambda: len(got) >= 2000)
+        await a.stop()
+        await b.stop()
+        return got
+
+    got = asyncio.run(run())
+    assert [event["n"] for event in got] == list(range(2000))
+
+
+def test_overflowing_peer_gets_gap(monkeypatch):
+    monkeypatch.setattr(broker, "PEER_QUEUE_SIZE", 10)
+
+    async def run():
+        (a, b), (_, got) = await _pair(tempfile.mkdtemp())
+        # No yield between publishes: the stream cannot drain, so the queue overflows
+        for i in range(50):
+            await a.publish({"kind": "broadcast", "n": i})
+        await _until(lambda: broker.GAP_EVENT in got)
+        await a.stop()
+        await b.stop()
+        return got
+
+    got = asyncio.run(run())
+    assert broker.GAP_EVENT in got
+
+
+def test_clean_stop_is_not_a_gap():
+    async def run():
+        (a, b), (_, got) = await _pair(tempfile.mkdtemp())
+        await a.publish({"kind": "broadcast", "n": 1})
+        await a.stop()
+        await asyncio.sleep(0.2)
+        await b.stop()
+        return got
+
+    got = asyncio.run(run())
+    assert got == [{"kind": "broadcast", "n": 1}]
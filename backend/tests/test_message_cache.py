@@ -0,0 +1,89 @@
+"""Ring fills must never lose a message that raced them, and stale rings must expire."""
+import message_cache
+
+
+def _msg(message_id: int, channel_id: int = 1) -> dict:
+    return {"id": message_id, "channel_id": channel_id, "content": f"m{message_id}"}
+
+
+def _ids(messages):
+    return [m["id"] for m in messages]
+
+
+def test_fill_installs_latest_page():
+    cache = message_cache.MessageCache()
+    assert cache.get_latest(1, 10) is None
+    token = cache.begin_fill(1)
+    cache.finish_fill(1, token, [_msg(3), _msg(2), _msg(1)])
+    assert _ids(cache.get_latest(1, 2)) == [3, 2]
+
+
+def test_broadcast_during_fill_is_kept():
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    # Committed after the DB read, broadcast before the fill finished
+    cache.add(_msg(4))
+    cache.finish_fill(1, token, [_msg(3), _msg(2)])
+    assert _ids(cache.get_latest(1, 10)) == [4, 3, 2]
+
+
+def test_older_fill_finishing_last_keeps_newer_messages():
+    cache = message_cache.MessageCache()
+    slow = cache.begin_fill(1)
+    fast = cache.begin_fill(1)
+    cache.add(_msg(3))
+    cache.finish_fill(1, fast, [_msg(3), _msg(2)])
+    cache.add(_msg(4))
+    # The slow read saw neither 3 nor 4
+    cache.finish_fill(1, slow, [_msg(2), _msg(1)])
+    assert _ids(cache.get_latest(1, 10)) == [4, 3, 2, 1]
+
+
+def test_out_of_order_broadcasts_are_sorted():
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    cache.finish_fill(1, token, [_msg(2)])
+    cache.add(_msg(5))
+    cache.add(_msg(4))
+    cache.add(_msg(5))
+    assert _ids(cache.get_latest(1, 10)) == [5, 4, 2]
+
+
+def test_clear_abandons_inflight_fill():
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    cache.clear()
+    cache.finish_fill(1, token, [_msg(1)])
+    assert cache.get_latest(1, 10) is None
+    assert not cache._loading
+
+
+def test_abandoned_fill_stops_collecting():
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    cache.abandon_fill(1, token)
+    cache.add(_msg(1))
+    assert not cache._loading
+    assert cache.get_latest(1, 10) is None
+
+
+def test_ring_is_bounded(monkeypatch):
+    monkeypatch.setattr(message_cache, "RING_SIZE", 3)
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    cache.finish_fill(1, token, [_msg(3), _msg(2), _msg(1)])
+    cache.add(_msg(4))
+    # Older than everything in a full ring: not cached
+    cache.add(_msg(0))
+    assert _ids(cache.get_latest(1, 3)) == [4, 3, 2]
+    assert cache.size == sum(message_cache._entry_size(m) for m in cache.rings[1].messages)
+
+
+def test_stale_ring_expires(monkeypatch):
+    monkeypatch.setattr(message_cache, "MAX_AGE_SECONDS", 60)
+    cache = message_cache.MessageCache()
+    token = cache.begin_fill(1)
+    cache.finish_fill(1, token, [_msg(1)])
+    cache.rings[1].loaded_at -= 61
+    assert cache.get_latest(1, 10) is None
+    assert cache.size == 0 and cache.stats()["expirations"] == 1
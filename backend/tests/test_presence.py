@@ -0,0 +1,57 @@
+"""Presence counts heal from snapshots, whatever events were lost."""
+import asyncio
+
+import presence
+
+
+def _hub():
+    published = []
+
+    async def publish(event):
+        published.append(event)
+
+    return presence.PresenceHub(publish, {}), published
+
+
+def test_snapshot_repairs_lost_offline_event():
+    hub, _ = _hub()
+    hub.apply({"kind": "presence", "worker": "a", "user_id": 1, "online": True})
+    hub.apply({"kind": "presence", "worker": "a", "user_id": 2, "online": True})
+    # The offline event for user 1 never arrived; worker a's next snapshot says who is left
+    hub.apply({"kind": "presence_snapshot", "worker": "a", "users": [2]})
+    assert hub.sessions == {2: 1}
+    assert hub._changed == {2: True}
+
+
+def test_user_on_two_workers_stays_online_until_both_leave():
+    hub, _ = _hub()
+    hub.apply({"kind": "presence", "worker": "a", "user_id": 1, "online": True})
+    hub.apply({"kind": "presence", "worker": "b", "user_id": 1, "online": True})
+    hub.apply({"kind": "presence_snapshot", "worker": "a", "users": [], "final": True})
+    assert hub.sessions == {1: 1}
+    assert "a" not in hub.worker_users
+    hub.apply({"kind": "presence", "worker": "b", "user_id": 1, "online": False})
+    assert hub.sessions == {}
+
+
+def test_silent_worker_expires():
+    hub, _ = _hub()
+    hub.apply({"kind": "presence", "worker": "a", "user_id": 1, "online": True})
+    hub.worker_seen["a"] -= presence.WORKER_TIMEOUT_SECONDS + 1
+    hub._expire_workers(presence.time.monotonic())
+    assert hub.sessions == {} and not hub.worker_users
+
+
+def test_stop_takes_local_users_offline():
+    async def run():
+        hub, published = _hub()
+        await hub.connected(1)
+        for event in published:
+            hub.apply(event)
+        await hub.stop()
+        hub.apply(published[-1])
+        return hub, published
+
+    hub, published = asyncio.run(run())
+    assert published[-1] == {"kind": "presence_snapshot", "worker": hub.worker_id, "users": [], "final": True}
+    assert hub.sessions == {}
@@ -0,0 +1,93 @@
+"""Server listings must cost a fixed number of statements, whatever the data size."""
+import uuid
+
+import crud
+import models
+import schemas
+
+
+def _user(db) -> models.User:
+    user = models.User(username=f"u-{uuid.uuid4().hex[:8]}", hashed_password="x")
+    db.add(user)
+    db.commit()
+    return user
+
+
+def _servers_with_channels(db, owner: models.User, count: int, channels: int):
+    owner_id = owner.id
+    servers = []
+    for i in range(count):
+        server = crud.create_server(db, schemas.ServerCreate(name=f"s{i}"), owner_id)
+        for c in range(channels - 1):
+            crud.create_channel(db, schemas.ChannelCreate(name=f"c{c}"), server.id)
+        servers.append(server)
+    # Start from an empty identity map so nothing is served without a query
+    db.expire_all()
+    return servers
+
+
+def test_get_servers_batches_channels(db, count_queries):
+    owner = _user(db)
+    owner_id = owner.id
+    _servers_with_channels(db, owner, count=20, channels=3)
+
+    with count_queries() as statements:
+        servers = crud.get_servers(db, user_id=owner_id)
+        # Touching the channels must not lazy-load per server
+        channel_count = sum(len(s.channels) for s in servers)
+
+    assert len(servers) == 20
+    assert channel_count == 60
+    # One for the servers, one selectin load for all their channels
+    assert len(statements) == 2
+
+
+def test_get_all_servers_page_is_one_query(db, count_queries):
+    owner = _user(db)
+    _servers_with_channels(db, owner, count=15, channels=2)
+
+    with count_queries() as statements:
+        first = crud.get_all_servers(db, limit=10)
+    assert len(first) == 10
+    assert len(statements) == 1
+
+    with count_queries() as statements:
+        second = crud.get_all_servers(db, limit=10, after=first[-1].id)
+    assert second and second[0].id > first[-1].id
+    assert len(statements) == 1
+
+
+def test_message_batch_is_one_insert(db):
+    import asyncio
+    from sqlalchemy import event
+
+    import database
+
+    owner = _user(db)
+    server = crud.create_server(db, schemas.ServerCreate(name="batch"), owner.id)
+    channel_id = server.channels[0].id
+    rows = [{"content": f"m{i}", "user_id": owner.id, "channel_id": channel_id} for i in range(10)]
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def insert_batch():
+        try:
+            async with database.AsyncSessionLocal() as session:
+                return await crud.create_messages_async(session, rows)
+        finally:
+            await database.async_engine.dispose()
+
+    engine = database.async_engine.sync_engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        persisted = asyncio.run(insert_batch())
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert len([s for s in statements if s.lstrip().upper().startswith("INSERT")]) == 1
+    contents = dict(db.query(models.Message.id, models.Message.content).filter(
+        models.Message.id.in_([row.id for row in persisted])
+    ).all())
+    assert [contents[row.id] for row in persisted] == [row["content"] for row in rows]
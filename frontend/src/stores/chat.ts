@@ -1,5 +1,6 @@
 import { defineStore } from 'pinia'
 import axios from 'axios'
+import { ElMessage } from 'element-plus'
 import { useAuthStore } from './auth'
 
 const API_URL = import.meta.env.PROD ? '/api' : 'http://localhost:8000'
@@ -34,6 +35,10 @@ interface Server {
   invite_code?: string;
 }
 
+let typingTimer: ReturnType<typeof setInterval> | null = null
+// Messages sent over the socket and not acked yet, by nonce
+const pendingSends = new Map<string, { channelId: number; content: string }>()
+
 export const useChatStore = defineStore('chat', {
   state: () => ({
     servers: [] as Server[],
@@ -43,6 +48,10 @@ export const useChatStore = defineStore('chat', {
     currentServerId: null as number | null,
     currentChannelId: null as number | null,
     socket: null as WebSocket | null,
+    // Presence of the current server's members and typists in the current channel (user id -> expiry ms)
+    onlineUserIds: [] as number[],
+    typing: {} as Record<number, number>,
+    lastTypingSent: 0,
   }),
   actions: {
     getHeaders() {
@@ -90,15 +99,17 @@ export const useChatStore = defineStore('chat', {
       this.channels = []
       this.messages = []
       this.members = []
+      this.onlineUserIds = []
 
       try {
-        const [channelsRes, membersRes] = await Promise.all([
+        const [channelsRes, members] = await Promise.all([
           axios.get(`${API_URL}/servers/${serverId}/channels`, { headers: this.getHeaders() }),
-          axios.get(`${API_URL}/servers/${serverId}/members`, { headers: this.getHeaders() })
+          this.fetchAllMembers(serverId)
         ])
+        if (this.currentServerId !== serverId) return
 
         this.channels = channelsRes.data
-        this.members = membersRes.data
+        this.members = members
 
         if (this.channels.length > 0 && this.channels[0]) {
           this.selectChannel(this.channels[0].id)
@@ -108,6 +119,21 @@ export const useChatStore = defineStore('chat', {
       }
     },
 
+    // The members endpoint is paginated by user id; follow `after` until a short page
+    async fetchAllMembers(serverId: number) {
+      const pageSize = 500
+      const members: User[] = []
+      while (true) {
+        const after = members.length ? members[members.length - 1]!.id : undefined
+        const res = await axios.get(`${API_URL}/servers/${serverId}/members`, {
+          params: { limit: pageSize, after },
+          headers: this.getHeaders()
+        })
+        members.push(...res.data)
+        if (res.data.length < pageSize) return members
+      }
+    },
+
     async createChannel(name: string) {
       if (!this.currentServerId) return
       await axios.post(`${API_URL}/servers/${this.currentServerId}/channels`, { name }, { headers: this.getHeaders() })
@@ -116,6 +142,8 @@ export const useChatStore = defineStore('chat', {
 
     async selectChannel(channelId: number) {
       this.currentChannelId = channelId
+      this.typing = {}
+      this.sendViewChannel()
       try {
         const res = await axios.get(`${API_URL}/channels/${channelId}/messages`, { headers: this.getHeaders() })
         // API returns newest first usually, but let's check backend. 
@@ -129,18 +157,104 @@ export const useChatStore = defineStore('chat', {
 
     async sendMessage(content: string) {
       if (!this.currentChannelId) return
+      // Prefer the open socket (acked with the saved id); fall back to REST
+      if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+        const nonce = `${Date.now()}-${Math.random().toString(36).slice(2)}`
+        pendingSends.set(nonce, { channelId: this.currentChannelId, content })
+        this.socket.send(JSON.stringify({ type: 'send_message', nonce, channel_id: this.currentChannelId, content }))
+        return
+      }
       await axios.post(`${API_URL}/channels/${this.currentChannelId}/messages`, { content }, { headers: this.getHeaders() })
       // Message will be added via WebSocket
     },
 
+    // The server rejected a socket send without saving it. Transient failures are sent again
+    // over REST; anything else (not a member, invalid, expired token) is shown to the user
+    async failSend(nonce: string, retryable: boolean) {
+      const pending = pendingSends.get(nonce)
+      if (!pending) return
+      pendingSends.delete(nonce)
+      if (!retryable) {
+        ElMessage.error('消息发送失败')
+        return
+      }
+      try {
+        await axios.post(`${API_URL}/channels/${pending.channelId}/messages`, { content: pending.content }, { headers: this.getHeaders() })
+      } catch (e) {
+        console.error(e)
+        ElMessage.error('消息发送失败')
+      }
+    },
+
+    // Tell the server which channel is open; presence and typing frames are only sent for it
+    sendViewChannel() {
+      if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+        this.socket.send(JSON.stringify({ type: 'view_channel', channel_id: this.currentChannelId }))
+      }
+    },
+
+    // Called on input; the server debounces too, this just avoids a frame per keystroke
+    sendTyping() {
+      const now = Date.now()
+      if (!this.currentChannelId || now - this.lastTypingSent < 2000) return
+      if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+        this.lastTypingSent = now
+        this.socket.send(JSON.stringify({ type: 'typing', channel_id: this.currentChannelId }))
+      }
+    },
+
+    pruneTyping() {
+      const now = Date.now()
+      for (const [userId, expires] of Object.entries(this.typing)) {
+        if (expires <= now) delete this.typing[Number(userId)]
+      }
+    },
+
+    // After a (re)connect, fetch what the open channel missed in one request
+    async syncMissed() {
+      const channelId = this.currentChannelId
+      if (!channelId || this.messages.length === 0) return
+      const lastSeen = this.messages[this.messages.length - 1]!.id
+      try {
+        const res = await axios.post(`${API_URL}/sync`, { channels: { [channelId]: lastSeen } }, { headers: this.getHeaders() })
+        if (this.currentChannelId !== channelId) return
+        this.appendMissed(res.data.messages)
+        if (!res.data.truncated.includes(channelId)) return
+        // More was missed than /sync returns at once: walk forward with `after` (oldest first, contiguous)
+        const pageSize = 100
+        for (let page = 0; page < 10; page++) {
+          const after = this.messages[this.messages.length - 1]!.id
+          const more = await axios.get(`${API_URL}/channels/${channelId}/messages`, {
+            params: { after, limit: pageSize },
+            headers: this.getHeaders(),
+          })
+          if (this.currentChannelId !== channelId) return
+          this.appendMissed(more.data.reverse())
+          if (more.data.length < pageSize) return
+        }
+        // Too far behind to be worth filling in: show the latest page instead
+        await this.selectChannel(channelId)
+      } catch (e) {
+        console.error(e)
+      }
+    },
+
+    appendMissed(messages: Message[]) {
+      const known = new Set(this.messages.map(m => m.id))
+      this.messages.push(...messages.filter(m => !known.has(m.id)))
+    },
+
     connectWebSocket() {
       const auth = useAuthStore()
       if (!auth.user || this.socket) return
 
-      this.socket = new WebSocket(`${WS_URL}/${auth.user.id}`)
+      // The token lets this socket send messages, not just receive them
+      this.socket = new WebSocket(`${WS_URL}/${auth.user.id}?token=${encodeURIComponent(auth.token)}`)
 
       this.socket.onopen = () => {
         console.log("WS Connected")
+        this.sendViewChannel()
+        this.syncMissed()
       }
 
       this.socket.onmessage = (event) => {
@@ -148,13 +262,43 @@ export const useChatStore = defineStore('chat', {
         if (data.type === 'new_message') {
           if (data.message.channel_id === this.currentChannelId) {
             this.messages.push(data.message)
+            delete this.typing[data.message.user_id]
           }
+        } else if (data.type === 'presence_state') {
+          if (data.server_id === this.currentServerId) this.onlineUserIds = data.online
+        } else if (data.type === 'presence') {
+          if (data.server_id === this.currentServerId) {
+            const online = new Set(this.onlineUserIds)
+            data.online.forEach((id: number) => online.add(id))
+            data.offline.forEach((id: number) => online.delete(id))
+            this.onlineUserIds = [...online]
+          }
+          if (data.channel_id === this.currentChannelId) {
+            const expires = Date.now() + data.typing_ttl * 1000
+            data.typing.forEach((id: number) => { this.typing[id] = expires })
+          }
+        } else if (data.type === 'resync') {
+          // The server may have missed messages from another worker
+          this.syncMissed()
+        } else if (data.type === 'ack') {
+          pendingSends.delete(data.nonce)
+        } else if (data.type === 'error') {
+          console.error('WS error', data.nonce, data.detail)
+          if (data.nonce) this.failSend(data.nonce, data.retryable === true)
         }
       }
 
+      // Typists expire client-side; the server only says who started or kept typing
+      if (!typingTimer) typingTimer = setInterval(() => this.pruneTyping(), 1000)
+
       this.socket.onclose = () => {
         console.log("WS Disconnected")
         this.socket = null
+        // Not retried: the server may have saved them before the socket dropped (syncMissed shows those)
+        if (pendingSends.size) {
+          pendingSends.clear()
+          ElMessage.warning('连接已断开，部分消息可能未发送')
+        }
         // Reconnect logic could go here
       }
     }
@@ -141,6 +141,9 @@ fi
 
 ./venv/bin/pip install -r requirements.txt
 
+echo "Running database migrations..."
+./venv/bin/python migrate.py
+
 echo "Restarting Systemd service..."
 # 尝试重启服务，如果服务不存在则发出警告
 if systemctl list-units --full -all | grep -q "quicklink.service"; then
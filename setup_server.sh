@@ -41,6 +41,10 @@ fi
 # 安装 Python 依赖
 ./venv/bin/pip install -r requirements.txt
 
+# 数据库迁移 (只在这里执行一次，后端进程启动时不再迁移)
+# 以服务运行的用户执行，避免数据库文件属于 root
+sudo -u "$SUDO_USER" ./venv/bin/python migrate.py
+
 # 5. 配置 Systemd 服务
 echo ">>> 配置 Systemd 服务 (quicklink.service)..."
 SERVICE_FILE="/etc/systemd/system/quicklink.service"